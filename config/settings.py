@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Профилирование запросов; первым, чтобы учитывать запросы остальных middleware
+    "mailing_management.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -159,9 +161,127 @@ EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 CACHES = {
+    # Двухуровневый кеш: LRU в памяти процесса перед общим для всех воркеров кешем "shared"
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',  # Локальный кеш в памяти
-        'LOCATION': 'unique-snowflake',
-    }
+        'BACKEND': 'mailing_management.tiered_cache.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': int(os.getenv("CACHE_L1_MAX_ENTRIES", 1000)),
+            'L1_TIMEOUT': float(os.getenv("CACHE_L1_TIMEOUT", 5)),
+            'EPOCH_INTERVAL': float(os.getenv("CACHE_EPOCH_INTERVAL", 1)),
+        },
+    },
+    # Общий кеш: Redis, если задан REDIS_URL (нужен пакет redis),
+    # иначе файлы на диске (общие для процессов одной машины).
+    # TIMEOUT=None: incr у файлового кеша перезаписывает значение со сроком по умолчанию.
+    # Файловый кеш при MAX_ENTRIES вытесняет самые старые записи;
+    # счетчики версий не вытесняются
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL"),
+    } if os.getenv("REDIS_URL") else {
+        'BACKEND': 'mailing_management.tiered_cache.SharedFileCache',
+        'LOCATION': os.getenv("CACHE_DIR", BASE_DIR / "cache"),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv("CACHE_MAX_ENTRIES", 100000)),
+        },
+    },
 }
 
+
+# Массовая рассылка: сколько писем отправлять через одно SMTP-соединение
+NEWSLETTER_BATCH_SIZE = int(os.getenv("NEWSLETTER_BATCH_SIZE", 100))
+# Число параллельных потоков отправки (у каждого свое SMTP-соединение)
+NEWSLETTER_WORKERS = int(os.getenv("NEWSLETTER_WORKERS", 1))
+NEWSLETTER_MAX_WORKERS = int(os.getenv("NEWSLETTER_MAX_WORKERS", 16))
+# Попытки отправки сбрасываются в базу каждые N писем или T секунд
+NEWSLETTER_FLUSH_SIZE = int(os.getenv("NEWSLETTER_FLUSH_SIZE", 500))
+NEWSLETTER_FLUSH_INTERVAL = float(os.getenv("NEWSLETTER_FLUSH_INTERVAL", 5))
+
+# Очередь исходящих писем (команда run_mail_worker)
+MAIL_WORKER_BATCH = int(os.getenv("MAIL_WORKER_BATCH", 200))
+MAIL_WORKER_IDLE_SLEEP = float(os.getenv("MAIL_WORKER_IDLE_SLEEP", 2))
+# Через сколько секунд задание зависшего воркера возвращается в очередь
+MAIL_WORKER_LEASE = int(os.getenv("MAIL_WORKER_LEASE", 600))
+
+# Ограничение скорости отправки, писем в секунду; по умолчанию выключено (0),
+# и паузы появляются только после временных отказов сервера (NEWSLETTER_BACKOFF_*).
+# Лимит общий для всех потоков процесса, т.е. для всех --workers вместе;
+# NEWSLETTER_RATE_SHARED=True - одно ограничение на все воркеры через кеш;
+# нужен кеш с атомарным incr (Redis, REDIS_URL), файловый кеш не подходит
+NEWSLETTER_RATE_LIMIT = float(os.getenv("NEWSLETTER_RATE_LIMIT", 0))
+NEWSLETTER_RATE_BURST = int(os.getenv("NEWSLETTER_RATE_BURST", 10))
+NEWSLETTER_RATE_SHARED = os.getenv("NEWSLETTER_RATE_SHARED") == "True"
+# Ниже какой доли от лимита скорость не опускается при отказах сервера
+NEWSLETTER_RATE_MIN_FACTOR = 0.1
+# Без лимита: пауза между письмами после первого временного отказа и ее предел, секунды
+NEWSLETTER_BACKOFF_DELAY = float(os.getenv("NEWSLETTER_BACKOFF_DELAY", 0.5))
+NEWSLETTER_BACKOFF_MAX_DELAY = float(os.getenv("NEWSLETTER_BACKOFF_MAX_DELAY", 30))
+# Повторы после временных отказов (4xx): число попыток и базовая пауза в секундах
+NEWSLETTER_MAX_RETRIES = int(os.getenv("NEWSLETTER_MAX_RETRIES", 5))
+NEWSLETTER_RETRY_DELAY = int(os.getenv("NEWSLETTER_RETRY_DELAY", 60))
+
+# Планировщик рассылок (команда run_scheduler): границы паузы между проходами, секунды
+SCHEDULER_MIN_SLEEP = float(os.getenv("SCHEDULER_MIN_SLEEP", 1))
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", 60))
+
+# Сколько получателей читать из базы за раз при отправке
+NEWSLETTER_RECIPIENT_CHUNK = int(os.getenv("NEWSLETTER_RECIPIENT_CHUNK", 2000))
+
+# Сводки попыток по часам и дням (команда rollup_attempts и run_mail_worker)
+NEWSLETTER_ROLLUP_BATCH = int(os.getenv("NEWSLETTER_ROLLUP_BATCH", 10000))
+# Попытки моложе стольких секунд ждут следующего прохода
+NEWSLETTER_ROLLUP_LAG = int(os.getenv("NEWSLETTER_ROLLUP_LAG", 60))
+# Как часто воркер очереди обновляет сводки, секунды (0 - не обновляет)
+NEWSLETTER_ROLLUP_INTERVAL = float(os.getenv("NEWSLETTER_ROLLUP_INTERVAL", 60))
+
+# Страница статистики: за сколько дней показывать разбивку и сколько секунд кешировать
+STATISTICS_DAYS = 14
+STATISTICS_CACHE_TIMEOUT = 60 * 60
+
+# Журнал попыток: сколько символов ответа сервера хранить, через сколько дней
+# переносить попытки в архив и куда (команда archive_attempts)
+NEWSLETTER_ERROR_MAX_LENGTH = 500
+ATTEMPT_RETENTION_DAYS = int(os.getenv("ATTEMPT_RETENTION_DAYS", 90))
+ATTEMPT_ARCHIVE_DIR = BASE_DIR / "archive"
+
+# Размер страницы списков получателей, писем и рассылок
+LIST_PAGE_SIZE = 50
+
+# Получателей на странице таблицы в рассылке
+RECIPIENT_PAGE_SIZE = 100
+# Сколько первых получателей показывать у рассылки в списке рассылок
+NEWSLETTER_CLIENTS_PREVIEW = 5
+
+# Список получателей кешируется для каждого пользователя, секунды
+CLIENT_LIST_CACHE_TIMEOUT = 60 * 15
+
+# Админка: сколько получателей показывать в списке рассылок и с какого размера
+# таблицы брать оценку числа строк из статистики PostgreSQL вместо COUNT(*)
+ADMIN_CLIENTS_PREVIEW = 5
+ADMIN_ESTIMATED_COUNT_FROM = 100000
+
+# CSV-выгрузки: строк на чтение из базы и примерный размер отдаваемого куска
+EXPORT_ROWS_CHUNK = 2000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Профилирование запросов (mailing_management.middleware.ProfilingMiddleware):
+# включается PROFILING_ENABLED=True; медленным считается запрос дольше PROFILING_SLOW_MS,
+# в журнал медленных попадает доля PROFILING_SAMPLE_RATE из них
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED") == "True"
+PROFILING_SLOW_MS = float(os.getenv("PROFILING_SLOW_MS", 500))
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0.1))
+PROFILING_TOP_DUPLICATES = 5
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "mailing_management.profiling": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
@@ -1,30 +1,67 @@
 # admin.py
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Prefetch
+from django.utils.functional import cached_property
+
 from .models import MailingClient, MessageManagement, Newsletter
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор, который для больших таблиц без фильтров берет оценку числа строк
+    из статистики PostgreSQL (pg_class.reltuples) вместо COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if connection.vendor == "postgresql" and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [self.object_list.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # До первого ANALYZE reltuples равен -1, тогда считаем честно
+            if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_FROM:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    # Без полного COUNT(*) рядом с поиском и с оценкой числа строк для пагинации
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 # Register your models here.
 @admin.register(MailingClient)
-class MailingClientAdmin(admin.ModelAdmin):
+class MailingClientAdmin(LargeTableAdmin):
     list_display = (
         "email",
         "full_name",
         "comment",
     )
-    list_filter = ("email", "full_name")
+    # Поиск по началу адреса использует индекс client_email_prefix_idx;
+    # фильтры по email и ф.и.о. давали бы по пункту на каждое значение
+    search_fields = ("email__startswith",)
+    raw_id_fields = ("owner", "user")
 
 
 @admin.register(MessageManagement)
-class MessageManagementAdmin(admin.ModelAdmin):
+class MessageManagementAdmin(LargeTableAdmin):
     list_display = (
         "subject",
         "body",
     )
-    list_filter = ("subject",)
+    search_fields = ("subject__startswith",)
 
 
 @admin.register(Newsletter)
-class NewsletterAdmin(admin.ModelAdmin):
+class NewsletterAdmin(LargeTableAdmin):
     list_display = (
         "beginning_date",
         "end_date",
@@ -37,16 +74,31 @@ class NewsletterAdmin(admin.ModelAdmin):
         "beginning_date",
         "end_date",
     )
-    search_fields = (
-        "message__subject",
-        "clients__email",
-    )
+    search_fields = ("message__subject__startswith",)
+    autocomplete_fields = ("message", "clients")
+    raw_id_fields = ("owner",)
+
+    def get_queryset(self, request):
+        # Для каждой рассылки страницы - несколько первых получателей одним запросом
+        preview = MailingClient.objects.only("id", "email").order_by("email")
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("message")
+            .prefetch_related(
+                Prefetch(
+                    "clients",
+                    queryset=preview[: settings.ADMIN_CLIENTS_PREVIEW + 1],
+                    to_attr="preview_clients",
+                )
+            )
+        )
 
     def get_clients(self, obj):
-        # Метод для отображения списка клиентов в админке
-        return ", ".join([client.email for client in obj.clients.all()])
+        # Метод для отображения списка клиентов в админке: первые адреса без подсчета остальных
+        emails = [client.email for client in obj.preview_clients]
+        if len(emails) > settings.ADMIN_CLIENTS_PREVIEW:
+            return ", ".join(emails[: settings.ADMIN_CLIENTS_PREVIEW]) + ", …"
+        return ", ".join(emails)
 
     get_clients.short_description = "Получатели"
-
-
-# Не забудьте зарегистрировать связанные модели, если они еще не зарегистрированы
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MailingManagementConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "mailing_management"
+
+    def ready(self):
+        from . import signals  # noqa: F401
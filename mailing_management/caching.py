@@ -0,0 +1,39 @@
+import time
+
+from django.core.cache import cache
+
+# Счетчики версий живут дольше кешированных данных
+VERSION_TIMEOUT = None
+
+
+def initial_version():
+    # Новый счетчик начинается с текущего времени в миллисекундах, а не с 1:
+    # если счетчик вытеснили из кеша, старые версии не выдадутся повторно
+    return int(time.time() * 1000)
+
+
+def get_version(name):
+    version = cache.get(f"version:{name}")
+    if version is None:
+        version = initial_version()
+        # Счетчик мог успеть создать другой процесс - тогда берем его значение
+        if not cache.add(f"version:{name}", version, timeout=VERSION_TIMEOUT):
+            version = cache.get(f"version:{name}", version)
+    return version
+
+
+def bump_version(name):
+    """
+    Инвалидирует все ключи, собранные через versioned_key(name, ...).
+
+    Старые записи не удаляются, а просто перестают читаться и истекают сами.
+    """
+    try:
+        return cache.incr(f"version:{name}")
+    except ValueError:
+        cache.add(f"version:{name}", initial_version(), timeout=VERSION_TIMEOUT)
+        return cache.incr(f"version:{name}")
+
+
+def versioned_key(name, *parts):
+    return ":".join([name, f"v{get_version(name)}", *map(str, parts)])
@@ -0,0 +1,65 @@
+import csv
+import io
+import zlib
+
+from django.conf import settings
+
+from .models import MailingClient, NewsletterAttempt, NewsletterStatistics
+
+# Что можно выгрузить: модель, столбцы и поле владельца для ограничения доступа
+EXPORTS = {
+    "attempts": (
+        NewsletterAttempt,
+        ("id", "attempt_date", "status", "server_response", "newsletter_id", "client_id"),
+        "newsletter__owner",
+    ),
+    "clients": (
+        MailingClient,
+        ("id", "email", "full_name", "comment", "owner_id", "user_id"),
+        "owner",
+    ),
+    "statistics": (
+        NewsletterStatistics,
+        ("id", "newsletter_id", "total_sent", "successful_attempts", "failed_attempts", "last_update"),
+        "newsletter__owner",
+    ),
+}
+
+
+def export_queryset(name, user=None):
+    # Без пользователя (команда) или для менеджера выгружается все, иначе только свое
+    model, fields, owner_field = EXPORTS[name]
+    queryset = model.objects.order_by("id")
+    if user is not None and not user.is_staff:
+        queryset = queryset.filter(**{owner_field: user})
+    return fields, queryset.values_list(*fields)
+
+
+def csv_chunks(name, user=None):
+    """
+    Отдает CSV-выгрузку кусками примерно по EXPORT_CHUNK_BYTES.
+
+    Строки читаются через iterator(), поэтому память не зависит от размера
+    таблицы, а первый кусок готов сразу после первой порции строк.
+    """
+    fields, rows = export_queryset(name, user)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows.iterator(chunk_size=settings.EXPORT_ROWS_CHUNK):
+        writer.writerow(row)
+        if buffer.tell() >= settings.EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    # Потоковое сжатие в формат gzip (wbits=31)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
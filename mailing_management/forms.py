@@ -104,7 +104,8 @@ class MessageManagementModeratorForm(StyleFormMixin, ModelForm):
 class NewsletterForm(StyleFormMixin, ModelForm):
     class Meta:
         model = Newsletter
-        fields = "__all__"
+        # Статус меняют планировщик и отправка рассылки, а не владелец
+        exclude = ("status",)
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop("user", None)  # Получаем текущего пользователя
@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from itertools import groupby
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mailing_management.models import NewsletterAttempt, RollupCursor
+
+FIELDS = ("id", "attempt_date", "status", "server_response", "newsletter_id", "client_id")
+
+
+class Command(BaseCommand):
+    help = "Move old newsletter attempts into monthly gzip JSONL files and delete them from the table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.ATTEMPT_RETENTION_DAYS,
+            help="Archive attempts older than this many days",
+        )
+        parser.add_argument(
+            "--dir", default=settings.ATTEMPT_ARCHIVE_DIR, help="Directory for archive files"
+        )
+        parser.add_argument("--chunk", type=int, default=5000, help="Attempts per chunk")
+
+    def handle(self, *args, **options):
+        directory = Path(options["dir"])
+        directory.mkdir(parents=True, exist_ok=True)
+        cutoff = timezone.now() - timedelta(days=options["days"])
+
+        # Попытки, еще не учтенные в сводках, не трогаем - иначе они пропадут из отчетов
+        rolled_up = RollupCursor.objects.filter(name="attempts").values_list("last_id", flat=True).first() or 0
+        old = NewsletterAttempt.objects.filter(attempt_date__lt=cutoff, id__lte=rolled_up).order_by("id")
+
+        archived = 0
+        last_id = 0
+        while True:
+            rows = list(old.filter(id__gt=last_id).values(*FIELDS)[: options["chunk"]])
+            if not rows:
+                break
+            # Файл на каждый месяц: attempts-YYYY-MM.jsonl.gz, дописывается новыми gzip-блоками
+            for month, month_rows in groupby(rows, key=lambda row: row["attempt_date"].strftime("%Y-%m")):
+                with gzip.open(directory / f"attempts-{month}.jsonl.gz", "at", encoding="utf-8") as archive:
+                    for row in month_rows:
+                        archive.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+                    archive.flush()
+                    os.fsync(archive.fileno())
+            # Удаляем только после записи на диск; при сбое строки могут попасть в архив дважды
+            last_id = rows[-1]["id"]
+            NewsletterAttempt.objects.filter(id__in=[row["id"] for row in rows]).delete()
+            archived += len(rows)
+            self.stdout.write(f"Archived {archived} attempts")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{archived} attempts older than {cutoff:%Y-%m-%d} moved to {directory}")
+        )
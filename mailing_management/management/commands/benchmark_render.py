@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine
+
+from mailing_management.personalization import CompiledMessage
+
+SUBJECT = "Новости для {{ full_name }}"
+BODY = (
+    "Здравствуйте, {{ full_name }}!\n\n"
+    "Это письмо отправлено на адрес {{ email }}.\n"
+    + "Текст рассылки с новостями и предложениями.\n" * 20
+)
+
+
+class Command(BaseCommand):
+    help = "Measure per-recipient rendering cost of a personalized newsletter"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, default=10000, help="Number of recipients")
+
+    def handle(self, *args, **options):
+        count = options["recipients"]
+        recipients = [(f"client{i}@example.com", f"Клиент Номер {i}") for i in range(count)]
+        engine = Engine()
+
+        # Наивный путь: шаблон разбирается и MIME собирается для каждого получателя
+        started = time.perf_counter()
+        for email, full_name in recipients:
+            context = Context({"email": email, "full_name": full_name}, autoescape=False)
+            message = EmailMessage(
+                engine.from_string(SUBJECT).render(context),
+                engine.from_string(BODY).render(context),
+                settings.DEFAULT_FROM_EMAIL,
+                [email],
+            )
+            message.message().as_bytes(linesep="\r\n")
+        naive = time.perf_counter() - started
+
+        # Письмо разбирается один раз, для получателя подставляются только поля
+        started = time.perf_counter()
+        compiled = CompiledMessage(SUBJECT, BODY, settings.DEFAULT_FROM_EMAIL)
+        for email, full_name in recipients:
+            compiled.build(email, full_name).message().as_bytes()
+        fast = time.perf_counter() - started
+
+        self.stdout.write(f"template + MIME per recipient: {naive / count * 1e6:.1f} us")
+        self.stdout.write(f"compiled message per recipient: {fast / count * 1e6:.1f} us")
+        self.stdout.write(self.style.SUCCESS(f"Speedup: x{naive / fast:.1f}"))
@@ -0,0 +1,97 @@
+import socketserver
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from mailing_management.personalization import CompiledMessage
+from mailing_management.services import SMTPSession
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    # Минимальный SMTP-сервер: принимает любые письма и ничего с ними не делает
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost SMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 localhost")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.reply("250 OK")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Command(BaseCommand):
+    help = "Compare messages/sec of per-message send_mail and pooled SMTP sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000, help="Number of messages to send")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.NEWSLETTER_BATCH_SIZE,
+            help="Messages per SMTP session for the pooled mode",
+        )
+
+    def handle(self, *args, **options):
+        count = options["messages"]
+        sink = SMTPSink(("127.0.0.1", 0), SMTPSinkHandler)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        host, port = sink.server_address
+
+        smtp_settings = {
+            "EMAIL_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+            "EMAIL_HOST": host,
+            "EMAIL_PORT": port,
+            "EMAIL_USE_SSL": False,
+            "EMAIL_USE_TLS": False,
+            "EMAIL_HOST_USER": "",
+            "EMAIL_HOST_PASSWORD": "",
+        }
+        recipients = [f"client{i}@example.com" for i in range(count)]
+        try:
+            with override_settings(**smtp_settings):
+                # Текущий путь: отдельное соединение на каждое письмо
+                started = time.perf_counter()
+                for email in recipients:
+                    send_mail("Benchmark", "Body", settings.DEFAULT_FROM_EMAIL, [email])
+                per_message = time.perf_counter() - started
+
+                # Одно соединение на пачку писем
+                started = time.perf_counter()
+                message = CompiledMessage("Benchmark", "Body", settings.DEFAULT_FROM_EMAIL)
+                with SMTPSession(options["batch_size"]) as session:
+                    for email in recipients:
+                        session.send(message.build(email))
+                pooled = time.perf_counter() - started
+        finally:
+            sink.shutdown()
+            sink.server_close()
+
+        self.stdout.write(f"send_mail per message: {count / per_message:.0f} msg/s")
+        self.stdout.write(
+            f"pooled session (batch {options['batch_size']}): {count / pooled:.0f} msg/s"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Speedup: x{per_message / pooled:.1f}"))
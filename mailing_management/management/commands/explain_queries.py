@@ -0,0 +1,91 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from mailing_management.models import (
+    MailingClient,
+    MessageManagement,
+    Newsletter,
+    NewsletterAttempt,
+)
+from users.models import CustomUser
+
+
+def get_queries(owner):
+    # Запросы списков и планировщика в том виде, в каком их строят представления и сервисы
+    now = timezone.now()
+    newsletter = Newsletter.objects.filter(owner=owner).first()
+    return {
+        "client list (owner)": MailingClient.objects.filter(owner=owner)[:50],
+        "client list (staff)": MailingClient.objects.all()[:50],
+        "message list": MessageManagement.objects.all()[:50],
+        "newsletter list (owner)": Newsletter.objects.filter(owner=owner)[:50],
+        "newsletter list (owner, status)": Newsletter.objects.filter(owner=owner, status="started")[:50],
+        "scheduler: due": Newsletter.objects.filter(status="created", beginning_date__lte=now).order_by(
+            "beginning_date"
+        ),
+        "scheduler: expired": Newsletter.objects.filter(status__in=["created", "started"], end_date__lte=now),
+        "scheduler: started": Newsletter.objects.filter(status="started").values("id"),
+        "attempt history": NewsletterAttempt.objects.filter(newsletter=newsletter).order_by("-attempt_date")[:50],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Print EXPLAIN (ANALYZE on PostgreSQL) for the main list and scheduler queries. "
+        "Run it before and after 'migrate mailing_management 0014' to compare plans"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Create this many clients before explaining; skipped if data for this size already exists",
+        )
+        parser.add_argument("--label", default="", help="Heading written before the plans, e.g. before/after")
+        parser.add_argument("--output", help="Append the plans to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed(options["seed"])
+
+        owner = CustomUser.objects.filter(added_clients__isnull=False).first()
+        analyze = connection.vendor == "postgresql"
+        lines = [f"=== {options['label'] or connection.vendor} ==="]
+        for name, queryset in get_queries(owner).items():
+            lines.append(f"--- {name}")
+            lines.append(queryset.explain(analyze=True) if analyze else queryset.explain())
+        report = "\n".join(lines) + "\n"
+
+        if options["output"]:
+            with open(options["output"], "a", encoding="utf-8") as output:
+                output.write(report)
+            self.stdout.write(self.style.SUCCESS(f"Plans written to {options['output']}"))
+        else:
+            self.stdout.write(report)
+
+    def seed(self, count):
+        # Данные создает команда fill с префиксом fill{count}; при повторном запуске с тем же размером
+        # (замер "до" и "после") они уже есть, и повторная вставка упала бы на уникальных email
+        if CustomUser.objects.filter(email__startswith=f"fill{count}-").exists():
+            self.stdout.write(f"Data for --seed {count} already exists, skipping seeding")
+        else:
+            self.create(count)
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("ANALYZE")
+
+    def create(self, count):
+        call_command(
+            "fill",
+            users=10,
+            clients=count,
+            messages=max(count // 100, 1),
+            newsletters=max(count // 10, 1),
+            recipients=min(count, 100),
+            attempts=10,
+            seed=count,
+            stdout=self.stdout,
+        )
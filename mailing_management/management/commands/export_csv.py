@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from mailing_management.exports import EXPORTS, csv_chunks, gzip_chunks
+
+
+class Command(BaseCommand):
+    help = "Stream newsletter attempts, clients or statistics as CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", choices=sorted(EXPORTS), help="What to export")
+        parser.add_argument("--output", help="File to write to (stdout by default)")
+        parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip")
+
+    def handle(self, *args, **options):
+        chunks = csv_chunks(options["name"])
+        if options["gzip"]:
+            chunks = gzip_chunks(chunks)
+
+        output = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options["output"]:
+                output.close()
+            else:
+                output.flush()
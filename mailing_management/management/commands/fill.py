@@ -0,0 +1,143 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mailing_management.caching import bump_version
+from mailing_management.models import (
+    MailingClient,
+    MessageManagement,
+    Newsletter,
+    NewsletterAttempt,
+    NewsletterStatistics,
+    SiteCounter,
+)
+from mailing_management.services import chunked
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Fill the database with deterministic synthetic data for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="Number of users (client owners)")
+        parser.add_argument("--clients", type=int, default=10000, help="Number of clients")
+        parser.add_argument("--messages", type=int, default=100, help="Number of messages")
+        parser.add_argument("--newsletters", type=int, default=1000, help="Number of newsletters")
+        parser.add_argument("--recipients", type=int, default=100, help="Recipients per newsletter")
+        parser.add_argument("--attempts", type=int, default=10, help="Attempts per newsletter")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed; also prefixes emails")
+        parser.add_argument("--batch", type=int, default=5000, help="Rows per INSERT")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch = options["batch"]
+        prefix = f"fill{options['seed']}"
+        started = time.perf_counter()
+
+        # Хеш пароля считается один раз: make_password на каждого пользователя занял бы минуты
+        password = make_password("password")
+        user_ids = self.insert(
+            CustomUser,
+            (
+                CustomUser(
+                    email=f"{prefix}-user{i}@example.com",
+                    username=f"{prefix}-user{i}",
+                    password=password,
+                    is_active=True,
+                )
+                for i in range(options["users"])
+            ),
+        )
+        client_ids = self.insert(
+            MailingClient,
+            (
+                MailingClient(
+                    owner_id=self.rng.choice(user_ids),
+                    email=f"{prefix}-client{i}@example.com",
+                    full_name=f"Клиент {i}",
+                    comment="Сгенерирован командой fill",
+                )
+                for i in range(options["clients"])
+            ),
+        )
+        message_ids = self.insert(
+            MessageManagement,
+            (
+                MessageManagement(subject=f"Тема {i}", body=f"Текст письма {i}")
+                for i in range(options["messages"])
+            ),
+        )
+        newsletters = [
+            Newsletter(
+                owner_id=self.rng.choice(user_ids),
+                message_id=self.rng.choice(message_ids),
+                status=self.rng.choice(["created", "started", "finished"]),
+            )
+            for _ in range(options["newsletters"])
+        ]
+        newsletter_ids = self.insert(Newsletter, newsletters)
+
+        # Получатели пишутся прямо в промежуточную таблицу M2M, без add() на каждую рассылку
+        recipients = min(options["recipients"], len(client_ids))
+        recipient_lists = {
+            newsletter_id: self.rng.sample(client_ids, recipients) for newsletter_id in newsletter_ids
+        }
+        Through = Newsletter.clients.through
+        links = self.insert(
+            Through,
+            (
+                Through(newsletter_id=newsletter_id, mailingclient_id=client_id)
+                for newsletter_id, clients in recipient_lists.items()
+                for client_id in clients
+            ),
+            returning=False,
+        )
+
+        # Попытки генерируются потоком; счетчики статистики копятся по ходу
+        deltas = {}
+
+        def generate_attempts():
+            for newsletter_id, clients in recipient_lists.items():
+                for _ in range(options["attempts"] if clients else 0):
+                    successful = self.rng.random() < 0.9
+                    delta = deltas.setdefault(newsletter_id, [0, 0])
+                    delta[0 if successful else 1] += 1
+                    yield NewsletterAttempt(
+                        newsletter_id=newsletter_id,
+                        client_id=self.rng.choice(clients),
+                        status="successful" if successful else "failed",
+                        server_response="" if successful else "550 Mailbox unavailable",
+                    )
+
+        attempts = self.insert(NewsletterAttempt, generate_attempts(), returning=False)
+
+        # Массовые вставки минуют сигналы и счетчики - досчитываем их отдельно
+        with transaction.atomic():
+            for chunk in chunked(deltas.items(), self.batch):
+                NewsletterStatistics.apply_deltas(dict(chunk))
+        SiteCounter.recount()
+        bump_version("clients:all")
+        for owner_id in {newsletter.owner_id for newsletter in newsletters}:
+            transaction.on_commit(lambda owner_id=owner_id: bump_version(f"owner-stats:{owner_id}"))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {len(user_ids)} users, {len(client_ids)} clients, {len(message_ids)} messages, "
+                f"{len(newsletter_ids)} newsletters, {links} recipients and {attempts} attempts "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+        )
+
+    def insert(self, model, objects, returning=True):
+        # Вставка пачками по --batch строк; возвращает id созданных объектов или их число
+        ids = []
+        count = 0
+        for chunk in chunked(objects, self.batch):
+            created = model.objects.bulk_create(chunk)
+            count += len(created)
+            if returning:
+                ids.extend(obj.pk for obj in created)
+        return ids if returning else count
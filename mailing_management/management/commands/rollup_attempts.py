@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from mailing_management.rollups import rollup_attempts
+
+
+class Command(BaseCommand):
+    help = "Add newsletter attempts that are not rolled up yet to hourly and daily rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="Attempts processed per transaction")
+
+    def handle(self, *args, **options):
+        total = 0
+        while processed := rollup_attempts(options["batch_size"]):
+            total += processed
+            self.stdout.write(f"Rolled up {total} attempts")
+
+        self.stdout.write(self.style.SUCCESS(f"Rollups are up to date, {total} attempts added"))
@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mailing_management.rollups import rollup_attempts
+from mailing_management.services import (
+    ConcurrentSender,
+    claim_deliveries,
+    process_deliveries,
+    release_stale_deliveries,
+)
+
+
+class Command(BaseCommand):
+    help = "Process the outgoing mail queue; several workers may run at once"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch", type=int, default=settings.MAIL_WORKER_BATCH, help="Jobs claimed per iteration"
+        )
+        parser.add_argument(
+            "--workers", type=int, help="Number of parallel SMTP connections"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, help="Messages per SMTP session"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        processed = 0
+        rolled_up_at = time.monotonic()
+        with ConcurrentSender(options["workers"], options["batch_size"]) as sender:
+            while True:
+                release_stale_deliveries()
+                # Попутно досчитываем сводки попыток; занятые другим воркером пропускаются
+                interval = settings.NEWSLETTER_ROLLUP_INTERVAL
+                if interval and time.monotonic() - rolled_up_at >= interval:
+                    rollup_attempts()
+                    rolled_up_at = time.monotonic()
+                deliveries = claim_deliveries(options["batch"])
+                if not deliveries:
+                    if options["once"]:
+                        break
+                    time.sleep(settings.MAIL_WORKER_IDLE_SLEEP)
+                    continue
+                process_deliveries(deliveries, sender)
+                processed += len(deliveries)
+                self.stdout.write(f"Processed {processed} deliveries")
+
+        self.stdout.write(self.style.SUCCESS(f"Queue is empty, {processed} deliveries processed"))
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mailing_management.services import run_scheduler_tick
+
+
+class Command(BaseCommand):
+    help = "Start and finish newsletters according to beginning_date and end_date"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run a single scheduling pass and exit"
+        )
+        parser.add_argument(
+            "--max-sleep",
+            type=float,
+            default=settings.SCHEDULER_MAX_SLEEP,
+            help="Upper bound in seconds between scheduling passes",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            next_event = run_scheduler_tick()
+            if options["once"]:
+                break
+
+            # Спим до ближайшего события, но не дольше max-sleep:
+            # рассылки могут создать или изменить в любой момент
+            sleep = options["max_sleep"]
+            if next_event is not None:
+                until_next = (next_event - timezone.now()).total_seconds()
+                sleep = min(sleep, max(until_next, settings.SCHEDULER_MIN_SLEEP))
+            time.sleep(sleep)
+
+        self.stdout.write(self.style.SUCCESS("Scheduling pass finished"))
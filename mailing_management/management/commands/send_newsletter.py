@@ -1,22 +1,116 @@
-from django.core.management.base import BaseCommand
-from mailing_management.models import Newsletter
-from mailing_management.services import send_newsletter
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from mailing_management.models import Newsletter, NewsletterStatistics
+from mailing_management.services import enqueue_newsletter, send_newsletter
+
+
+def send_shard(newsletter_id, shards, shard_index, batch_size, workers, resume):
+    # Выполняется в дочернем процессе: у него свои соединения с базой и SMTP
+    newsletter = Newsletter.objects.select_related("message").get(id=newsletter_id)
+    send_newsletter(
+        newsletter,
+        batch_size=batch_size,
+        workers=workers,
+        shards=shards,
+        shard_index=shard_index,
+        resume=resume,
+    )
 
 
 class Command(BaseCommand):
-    help = "Send a newsletter by its ID"
+    help = "Queue a newsletter by its ID (or send it right away with --sync)"
 
     def add_arguments(self, parser):
         parser.add_argument(
             "newsletter_id", type=int, help="ID of the newsletter to send"
         )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="Send in this process instead of queueing for run_mail_worker",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Only send to recipients without a successful delivery",
+        )
+        parser.add_argument(
+            "--workers", type=int, help="Number of parallel SMTP connections (--sync)"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, help="Messages per SMTP session (--sync)"
+        )
+        parser.add_argument(
+            "--shards", type=int, default=1, help="Split recipients by client id into N shards (--sync)"
+        )
+        parser.add_argument(
+            "--shard-index", type=int, default=0, help="Shard sent by this process, 0..N-1 (--sync)"
+        )
+        parser.add_argument(
+            "--processes", type=int, help="Fork N processes, one per shard (--sync)"
+        )
 
     def handle(self, *args, **options):
         newsletter_id = options["newsletter_id"]
         newsletter = Newsletter.objects.get(id=newsletter_id)
+        shards = options["shards"]
+        shard_index = options["shard_index"]
+        processes = options["processes"]
+
+        if (shards > 1 or processes) and not options["sync"]:
+            raise CommandError("--shards and --processes require --sync")
+        if processes and shards > 1:
+            raise CommandError("Use either --processes or --shards/--shard-index")
+        if not 0 <= shard_index < shards:
+            raise CommandError("--shard-index must be between 0 and --shards - 1")
+
+        if not options["sync"]:
+            # Ставим рассылку в очередь, отправят ее воркеры
+            queued = enqueue_newsletter(newsletter, resume=options["resume"])
+            self.stdout.write(
+                self.style.SUCCESS(f"Newsletter {newsletter_id} queued for {queued} recipients")
+            )
+            return
 
-        # Отправляем рассылку
-        send_newsletter(newsletter)
+        if processes and processes > 1:
+            # Строку статистики создаем заранее, дочерние процессы только увеличивают счетчики
+            NewsletterStatistics.objects.get_or_create(newsletter=newsletter)
+            # Соединения с базой нельзя делить между процессами после fork
+            connections.close_all()
+            context = multiprocessing.get_context("fork")
+            children = [
+                context.Process(
+                    target=send_shard,
+                    args=(
+                        newsletter_id,
+                        processes,
+                        index,
+                        options["batch_size"],
+                        options["workers"],
+                        options["resume"],
+                    ),
+                )
+                for index in range(processes)
+            ]
+            for child in children:
+                child.start()
+            for child in children:
+                child.join()
+            failed = [index for index, child in enumerate(children) if child.exitcode != 0]
+            if failed:
+                raise CommandError(f"Shards {failed} of newsletter {newsletter_id} failed")
+        else:
+            # Отправляем рассылку
+            send_newsletter(
+                newsletter,
+                batch_size=options["batch_size"],
+                workers=options["workers"],
+                shards=shards,
+                shard_index=shard_index,
+                resume=options["resume"],
+            )
 
         self.stdout.write(
             self.style.SUCCESS(f"Newsletter {newsletter_id} sent successfully!")
@@ -0,0 +1,139 @@
+import functools
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger("mailing_management.profiling")
+
+# Профиль текущего запроса; вне запроса (команды, воркеры) - None, и обертки ничего не считают
+_current_profile = ContextVar("request_profile", default=None)
+_MISSING = object()
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.statements = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        # Обертка connection.execute_wrapper: время и текст каждого запроса
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, limit):
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+def _counting_get(get):
+    @functools.wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        profile = _current_profile.get()
+        if profile is None:
+            return get(self, key, default, version)
+        value = get(self, key, _MISSING, version)
+        if value is _MISSING:
+            profile.cache_misses += 1
+            return default
+        profile.cache_hits += 1
+        return value
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_cache_counters():
+    # Один раз подменяем get у класса кеша по умолчанию; нижний уровень двухуровневого
+    # кеша не оборачиваем, иначе одно чтение считалось бы дважды
+    backend = type(caches["default"])
+    if not getattr(backend.get, "profiled", False):
+        backend.get = _counting_get(backend.get)
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запросов: число и время SQL, попадания в кеш и время представления.
+
+    Результат уходит в заголовок Server-Timing и в журнал
+    mailing_management.profiling; медленные запросы (часть из них, см.
+    PROFILING_SAMPLE_RATE) пишутся с самыми частыми повторяющимися SQL.
+    При PROFILING_ENABLED=False middleware отключается при запуске и ничего не стоит.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_cache_counters()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        request.profile = profile
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile.execute))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        finished = time.perf_counter()
+        total = (finished - profile.started) * 1000
+        view = (finished - profile.view_started) * 1000 if profile.view_started else 0.0
+        db = profile.db_time * 1000
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={db:.1f};desc="{profile.queries} queries"',
+                f'cache;desc="{profile.cache_hits} hits, {profile.cache_misses} misses"',
+                f"view;dur={view:.1f}",
+                f"total;dur={total:.1f}",
+            ]
+        )
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total, 1),
+            "view_ms": round(view, 1),
+            "db_ms": round(db, 1),
+            "queries": profile.queries,
+            "cache_hits": profile.cache_hits,
+            "cache_misses": profile.cache_misses,
+        }
+        # Доля попаданий двухуровневого кеша с запуска процесса
+        stats = getattr(caches["default"], "stats", None)
+        if stats:
+            cache_stats = stats()
+            record["cache_hit_rate"] = round(cache_stats["hit_rate"], 3)
+            record["cache_l1_hit_rate"] = round(cache_stats["l1_hit_rate"], 3)
+        logger.info(json.dumps(record))
+        if total >= settings.PROFILING_SLOW_MS and random.random() < settings.PROFILING_SAMPLE_RATE:
+            record["duplicates"] = [
+                {"sql": sql, "count": count}
+                for sql, count in profile.duplicates(settings.PROFILING_TOP_DUPLICATES)
+            ]
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profile.view_started = time.perf_counter()
@@ -0,0 +1,100 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing_management", "0007_remove_newsletterstatistics_user_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NewsletterDelivery",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "В очереди"),
+                            ("processing", "Отправляется"),
+                            ("sent", "Отправлено"),
+                            ("failed", "Не отправлено"),
+                        ],
+                        default="pending",
+                        max_length=12,
+                        verbose_name="Статус отправки",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Число попыток"
+                    ),
+                ),
+                (
+                    "available_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Не раньше"
+                    ),
+                ),
+                (
+                    "locked_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Взято в работу"
+                    ),
+                ),
+                (
+                    "last_error",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="Последняя ошибка"
+                    ),
+                ),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="deliveries",
+                        to="mailing_management.mailingclient",
+                        verbose_name="Получатель",
+                    ),
+                ),
+                (
+                    "newsletter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="deliveries",
+                        to="mailing_management.newsletter",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "отправка получателю",
+                "verbose_name_plural": "отправки получателям",
+                "indexes": [
+                    models.Index(
+                        fields=["status", "available_at"], name="delivery_queue_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("newsletter", "client"),
+                        name="unique_newsletter_delivery",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing_management", "0008_newsletterdelivery"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="newsletterattempt",
+            name="client",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="attempts",
+                to="mailing_management.mailingclient",
+                verbose_name="Получатель",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:50
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def prepare_schedule(apps, schema_editor):
+    # Раньше end_date заполнялся датой создания и ничего не значил:
+    # у незавершенных рассылок считаем, что срока окончания нет
+    Newsletter = apps.get_model("mailing_management", "Newsletter")
+    Newsletter.objects.exclude(status="finished").update(end_date=None)
+    # beginning_date старых рассылок - дата создания, и планировщик разом запустил
+    # бы все незапущенные. Они остаются черновиками без даты первой отправки:
+    # планировщик их пропускает, пока владелец не задаст новую дату
+    Newsletter.objects.filter(status="created").update(beginning_date=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing_management", "0009_newsletterattempt_client"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="newsletter",
+            name="beginning_date",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                null=True,
+                verbose_name="Дата и время первой отправки",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="newsletter",
+            name="end_date",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Дата и время окончания отправки"
+            ),
+        ),
+        migrations.RunPython(prepare_schedule, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="newsletter",
+            index=models.Index(
+                fields=["status", "beginning_date"], name="newsletter_due_idx"
+            ),
+        ),
+    ]
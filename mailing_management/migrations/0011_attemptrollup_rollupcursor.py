@@ -0,0 +1,98 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing_management", "0010_newsletter_schedule"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RollupCursor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("last_id", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="AttemptRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("hour", "Час"), ("day", "День")],
+                        max_length=4,
+                        verbose_name="Период",
+                    ),
+                ),
+                ("bucket", models.DateTimeField(verbose_name="Начало периода")),
+                (
+                    "successful",
+                    models.PositiveIntegerField(default=0, verbose_name="Успешных"),
+                ),
+                (
+                    "failed",
+                    models.PositiveIntegerField(default=0, verbose_name="Неуспешных"),
+                ),
+                (
+                    "newsletter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="mailing_management.newsletter",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="attempt_rollups",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Владелец рассылки",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "сводка попыток",
+                "verbose_name_plural": "сводки попыток",
+                "indexes": [
+                    models.Index(
+                        fields=["owner", "period", "bucket"], name="rollup_owner_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("newsletter", "period", "bucket"),
+                        name="unique_attempt_rollup",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    # Начальные значения счетчиков главной страницы
+    Newsletter = apps.get_model("mailing_management", "Newsletter")
+    MailingClient = apps.get_model("mailing_management", "MailingClient")
+    SiteCounter = apps.get_model("mailing_management", "SiteCounter")
+    SiteCounter.objects.bulk_create(
+        [
+            SiteCounter(name="total_newsletters", value=Newsletter.objects.count()),
+            SiteCounter(
+                name="active_newsletters",
+                value=Newsletter.objects.filter(status="started").count(),
+            ),
+            SiteCounter(name="unique_recipients", value=MailingClient.objects.count()),
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing_management", "0011_attemptrollup_rollupcursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiteCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("value", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "счетчик",
+                "verbose_name_plural": "счетчики",
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:55
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+from mailing_management.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, а это невозможно внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("mailing_management", "0012_sitecounter"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="newsletterattempt",
+            index=models.Index(
+                fields=["newsletter", "-attempt_date"], name="attempt_history_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="newsletterattempt",
+            index=django.contrib.postgres.indexes.BrinIndex(
+                fields=["attempt_date"], name="attempt_date_brin"
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+from mailing_management.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, а это невозможно внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("mailing_management", "0013_attempt_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="mailingclient",
+            index=models.Index(
+                fields=["owner", "email", "full_name"], name="client_owner_order_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="mailingclient",
+            index=models.Index(fields=["email", "full_name"], name="client_order_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="messagemanagement",
+            index=models.Index(fields=["subject"], name="message_subject_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="newsletter",
+            index=models.Index(
+                fields=["owner", "status"], name="newsletter_owner_status_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="newsletter",
+            index=models.Index(
+                condition=models.Q(("status", "started")),
+                fields=["id"],
+                name="newsletter_started_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="newsletter",
+            index=models.Index(
+                condition=models.Q(("status__in", ["created", "started"])),
+                fields=["end_date"],
+                name="newsletter_open_end_idx",
+            ),
+        ),
+    ]
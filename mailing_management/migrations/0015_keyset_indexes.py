@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing_management", "0014_query_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="messagemanagement",
+            name="message_subject_idx",
+        ),
+        migrations.AddIndex(
+            model_name="messagemanagement",
+            index=models.Index(fields=["subject", "id"], name="message_subject_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="newsletter",
+            index=models.Index(
+                fields=["owner", "message", "id"], name="newsletter_owner_page_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+from mailing_management.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, а это невозможно внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("mailing_management", "0015_keyset_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="mailingclient",
+            index=models.Index(
+                fields=["email"],
+                name="client_email_prefix_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="messagemanagement",
+            index=models.Index(
+                fields=["subject"],
+                name="message_subject_prefix_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
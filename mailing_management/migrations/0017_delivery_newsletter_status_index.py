@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+from mailing_management.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, а это невозможно внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("mailing_management", "0016_search_prefix_indexes"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="newsletterdelivery",
+            index=models.Index(
+                fields=["newsletter", "status"], name="delivery_newsletter_status_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing_management", "0017_delivery_newsletter_status_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="mailingclient",
+            name="client_order_idx",
+        ),
+        migrations.AlterField(
+            model_name="mailingclient",
+            name="owner",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="added_clients",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="Владелец (кто добавил)",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="newsletter",
+            name="owner",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="newsletters",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
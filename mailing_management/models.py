@@ -1,4 +1,6 @@
-from django.db import models
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import connection, models
+from django.utils import timezone
 from config import settings
 from users.models import CustomUser
 
@@ -7,7 +9,7 @@ from users.models import CustomUser
 class MailingClient(models.Model):
     owner = models.ForeignKey(
         CustomUser, on_delete=models.SET_NULL, null=True, blank=True,
-        related_name="added_clients",
+        related_name="added_clients", db_index=False,
         verbose_name="Владелец (кто добавил)"
     )
     user = models.ForeignKey(
@@ -24,6 +26,14 @@ class MailingClient(models.Model):
         verbose_name = "получатель рассылки"
         verbose_name_plural = "получатели рассылок"
         ordering = ["email", "full_name"]
+        indexes = [
+            # Свои клиенты владельца в порядке ordering; общий список менеджера идет
+            # по уникальному индексу email - email уникален, full_name порядок не меняет.
+            # Индекс ведет по owner, поэтому отдельный индекс внешнего ключа не нужен
+            models.Index(fields=["owner", "email", "full_name"], name="client_owner_order_idx"),
+            # Поиск по началу адреса (LIKE 'abc%') в админке
+            models.Index(fields=["email"], name="client_email_prefix_idx", opclasses=["varchar_pattern_ops"]),
+        ]
         permissions = [
             ("can_unpublish_client", "Can unpublish client"),
             ("can_delete_client", "Can delete client"),
@@ -32,6 +42,13 @@ class MailingClient(models.Model):
             ("can_edit_client", "Can edit a client"),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Владелец из базы нужен сигналам, чтобы сбросить кеш списка прежнего владельца
+        instance.loaded_owner_id = instance.__dict__.get("owner_id")
+        return instance
+
     def __str__(self):
         return self.email
 
@@ -44,6 +61,11 @@ class MessageManagement(models.Model):
         verbose_name = "письмо"
         verbose_name_plural = "письма"
         ordering = ["subject"]
+        indexes = [
+            # Постраничный список писем по курсору (subject, id)
+            models.Index(fields=["subject", "id"], name="message_subject_idx"),
+            models.Index(fields=["subject"], name="message_subject_prefix_idx", opclasses=["varchar_pattern_ops"]),
+        ]
 
     def __str__(self):
         return f"{self.subject}"
@@ -56,6 +78,8 @@ class Newsletter(models.Model):
         related_name="newsletters",
         null=True,
         blank=True,
+        # Поиск по владельцу покрывают составные индексы (owner, status) и (owner, message, id)
+        db_index=False,
     )  # Разрешаем NULL
     NEWSLETTER_STATUS_CHOICES = [
         ("created", "Создана"),
@@ -63,11 +87,12 @@ class Newsletter(models.Model):
         ("finished", "Завершена"),
     ]
 
+    # NULL - черновик без даты (старые рассылки до появления планировщика), его не запускают
     beginning_date = models.DateTimeField(
-        auto_now_add=True, blank=True, verbose_name="Дата и время первой отправки"
+        default=timezone.now, null=True, verbose_name="Дата и время первой отправки"
     )
     end_date = models.DateTimeField(
-        auto_now_add=True, blank=True, verbose_name="Дата и время окончания отправки"
+        blank=True, null=True, verbose_name="Дата и время окончания отправки"
     )
     status = models.CharField(
         max_length=12,
@@ -84,6 +109,26 @@ class Newsletter(models.Model):
         verbose_name = "рассылка"
         verbose_name_plural = "рассылки"
         ordering = ["message"]
+        indexes = [
+            # Поиск рассылок, которые пора запускать (команда run_scheduler)
+            models.Index(fields=["status", "beginning_date"], name="newsletter_due_idx"),
+            # Рассылки владельца с фильтром по статусу; ordering идет через тему письма,
+            # поэтому (owner, message) не помог бы и не добавлен
+            models.Index(fields=["owner", "status"], name="newsletter_owner_status_idx"),
+            # Постраничный список рассылок владельца по курсору (message_id, id)
+            models.Index(fields=["owner", "message", "id"], name="newsletter_owner_page_idx"),
+            # Частичные индексы для планировщика: запущенные рассылки и незавершенные со сроком окончания
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status="started"),
+                name="newsletter_started_idx",
+            ),
+            models.Index(
+                fields=["end_date"],
+                condition=models.Q(status__in=["created", "started"]),
+                name="newsletter_open_end_idx",
+            ),
+        ]
 
         permissions = [
             ("can_unpublish_newsletter", "Can unpublish newsletter"),
@@ -91,6 +136,13 @@ class Newsletter(models.Model):
             ("view_all_newsletters", "View all newsletters"),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Статус из базы нужен сигналам, чтобы заметить его изменение
+        instance.loaded_status = instance.__dict__.get("status")
+        return instance
+
 
 class NewsletterAttempt(models.Model):
     ATTEMPT_STATUS_CHOICES = [
@@ -113,11 +165,26 @@ class NewsletterAttempt(models.Model):
         related_name="attempts",
         verbose_name="Рассылка",
     )
+    client = models.ForeignKey(
+        MailingClient,
+        on_delete=models.SET_NULL,
+        related_name="attempts",
+        null=True,
+        blank=True,
+        verbose_name="Получатель",
+    )
 
     class Meta:
         verbose_name = "попытка рассылки"
         verbose_name_plural = "попытки рассылок"
         ordering = ["-attempt_date"]
+        indexes = [
+            # История попыток одной рассылки
+            models.Index(fields=["newsletter", "-attempt_date"], name="attempt_history_idx"),
+            # Журнал только дописывается, поэтому BRIN по дате крошечный и хорошо
+            # подходит для выборки старых попыток при архивации
+            BrinIndex(fields=["attempt_date"], name="attempt_date_brin"),
+        ]
 
     def __str__(self):
         return f"Попытка {self.id} для рассылки {self.newsletter.id}"
@@ -133,9 +200,233 @@ class NewsletterStatistics(models.Model):
     last_update = models.DateTimeField(auto_now=True)
 
     def update_statistics(self, success=True):
-        if success:
-            self.successful_attempts += 1
+        # Атомарное увеличение в базе: параллельные отправители не теряют обновлений
+        if self.newsletter_id is None:
+            # NULL ни с чем не конфликтует, и UPSERT каждый раз добавлял бы новую строку
+            type(self).objects.filter(pk=self.pk).update(
+                total_sent=models.F("total_sent") + 1,
+                successful_attempts=models.F("successful_attempts") + int(success),
+                failed_attempts=models.F("failed_attempts") + int(not success),
+                last_update=timezone.now(),
+            )
         else:
-            self.failed_attempts += 1
-        self.total_sent += 1
-        self.save()
+            self.apply_deltas({self.newsletter_id: (1, 0) if success else (0, 1)})
+        self.refresh_from_db(fields=["total_sent", "successful_attempts", "failed_attempts", "last_update"])
+
+    @classmethod
+    def increment(cls, newsletter_id, successful=0, failed=0):
+        cls.apply_deltas({newsletter_id: (successful, failed)})
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Прибавляет к счетчикам нескольких рассылок одним запросом.
+
+        ``deltas`` - словарь {newsletter_id: (успешных, неуспешных)}.
+        INSERT ... ON CONFLICT DO UPDATE создает недостающие строки и
+        увеличивает существующие прямо в базе, без чтения и без гонок.
+        Строки идут в порядке newsletter_id, чтобы параллельные вызовы
+        блокировали их в одном порядке и не попадали во взаимную блокировку.
+        """
+        deltas = {newsletter_id: delta for newsletter_id, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        if None in deltas:
+            raise ValueError("Счетчики без рассылки нельзя обновить через apply_deltas")
+        table = connection.ops.quote_name(cls._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        params = []
+        for newsletter_id, (successful, failed) in sorted(deltas.items()):
+            params += [newsletter_id, successful + failed, successful, failed, now]
+        values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(deltas))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} "
+                f"(newsletter_id, total_sent, successful_attempts, failed_attempts, last_update) "
+                f"VALUES {values} "
+                f"ON CONFLICT (newsletter_id) DO UPDATE SET "
+                f"total_sent = {table}.total_sent + EXCLUDED.total_sent, "
+                f"successful_attempts = {table}.successful_attempts + EXCLUDED.successful_attempts, "
+                f"failed_attempts = {table}.failed_attempts + EXCLUDED.failed_attempts, "
+                f"last_update = EXCLUDED.last_update",
+                params,
+            )
+
+
+class NewsletterDelivery(models.Model):
+    """
+    Отправка рассылки одному получателю - задание в очереди исходящих писем.
+
+    Задания создаются при постановке рассылки в очередь и разбираются
+    командой run_mail_worker.
+    """
+
+    DELIVERY_STATUS_CHOICES = [
+        ("pending", "В очереди"),
+        ("processing", "Отправляется"),
+        ("sent", "Отправлено"),
+        ("failed", "Не отправлено"),
+    ]
+
+    newsletter = models.ForeignKey(
+        Newsletter,
+        on_delete=models.CASCADE,
+        related_name="deliveries",
+        verbose_name="Рассылка",
+    )
+    client = models.ForeignKey(
+        MailingClient,
+        on_delete=models.CASCADE,
+        related_name="deliveries",
+        verbose_name="Получатель",
+    )
+    status = models.CharField(
+        max_length=12,
+        choices=DELIVERY_STATUS_CHOICES,
+        default="pending",
+        verbose_name="Статус отправки",
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Число попыток")
+    available_at = models.DateTimeField(
+        default=timezone.now, verbose_name="Не раньше"
+    )
+    locked_at = models.DateTimeField(
+        blank=True, null=True, verbose_name="Взято в работу"
+    )
+    last_error = models.TextField(
+        blank=True, null=True, verbose_name="Последняя ошибка"
+    )
+
+    class Meta:
+        verbose_name = "отправка получателю"
+        verbose_name_plural = "отправки получателям"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["newsletter", "client"], name="unique_newsletter_delivery"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "available_at"], name="delivery_queue_idx"),
+            # Планировщик проверяет, остались ли у рассылки задания в очереди
+            models.Index(fields=["newsletter", "status"], name="delivery_newsletter_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.newsletter_id} -> {self.client_id}"
+
+    @classmethod
+    def enqueue_recipients(cls, newsletter_id):
+        """
+        Создает задания для всех получателей рассылки одним INSERT ... SELECT.
+
+        Строки копируются из промежуточной таблицы M2M прямо в базе, без
+        чтения id в Python; уже существующие задания пропускаются.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        through = connection.ops.quote_name(Newsletter.clients.through._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (newsletter_id, client_id, status, attempts, available_at) "
+                f"SELECT newsletter_id, mailingclient_id, 'pending', 0, %s FROM {through} "
+                f"WHERE newsletter_id = %s "
+                f"ON CONFLICT (newsletter_id, client_id) DO NOTHING",
+                [now, newsletter_id],
+            )
+            return cursor.rowcount
+
+
+class AttemptRollup(models.Model):
+    """
+    Число успешных и неуспешных попыток рассылки за час или день.
+
+    Заполняется инкрементально из NewsletterAttempt (см. rollups.py), чтобы
+    отчеты читали маленькую агрегатную таблицу, а не весь журнал попыток.
+    """
+
+    PERIOD_CHOICES = [
+        ("hour", "Час"),
+        ("day", "День"),
+    ]
+
+    newsletter = models.ForeignKey(
+        Newsletter,
+        on_delete=models.CASCADE,
+        related_name="rollups",
+        verbose_name="Рассылка",
+    )
+    owner = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        related_name="attempt_rollups",
+        null=True,
+        blank=True,
+        verbose_name="Владелец рассылки",
+    )
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, verbose_name="Период")
+    bucket = models.DateTimeField(verbose_name="Начало периода")
+    successful = models.PositiveIntegerField(default=0, verbose_name="Успешных")
+    failed = models.PositiveIntegerField(default=0, verbose_name="Неуспешных")
+
+    class Meta:
+        verbose_name = "сводка попыток"
+        verbose_name_plural = "сводки попыток"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["newsletter", "period", "bucket"], name="unique_attempt_rollup"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "period", "bucket"], name="rollup_owner_idx"),
+        ]
+
+
+class RollupCursor(models.Model):
+    # До какой попытки (по id) журнал уже учтен в сводках
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+
+
+class SiteCounter(models.Model):
+    """
+    Счетчик для главной страницы, поддерживаемый при изменениях данных.
+
+    Обновляется сигналами (signals.py) и функциями, меняющими статус рассылок
+    через UPDATE, поэтому главная страница не считает COUNT(*) на каждый запрос.
+    """
+
+    TOTAL_NEWSLETTERS = "total_newsletters"
+    ACTIVE_NEWSLETTERS = "active_newsletters"
+    UNIQUE_RECIPIENTS = "unique_recipients"
+
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "счетчик"
+        verbose_name_plural = "счетчики"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def add(cls, name, delta):
+        if delta and not cls.objects.filter(name=name).update(value=models.F("value") + delta):
+            cls.objects.get_or_create(name=name)
+            cls.objects.filter(name=name).update(value=models.F("value") + delta)
+
+    @classmethod
+    def get_values(cls, *names):
+        values = dict(cls.objects.filter(name__in=names).values_list("name", "value"))
+        return {name: values.get(name, 0) for name in names}
+
+    @classmethod
+    def recount(cls):
+        # Полный пересчет: после массовых вставок, которые минуют сигналы
+        counts = {
+            cls.TOTAL_NEWSLETTERS: Newsletter.objects.count(),
+            cls.ACTIVE_NEWSLETTERS: Newsletter.objects.filter(status="started").count(),
+            cls.UNIQUE_RECIPIENTS: MailingClient.objects.count(),
+        }
+        for name, value in counts.items():
+            cls.objects.update_or_create(name=name, defaults={"value": value})
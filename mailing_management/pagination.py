@@ -0,0 +1,87 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import BadRequest, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+KeysetPage = namedtuple("KeysetPage", ["object_list", "next_cursor"])
+
+
+def encode_cursor(values):
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise BadRequest("Некорректный курсор страницы")
+    if not isinstance(values, list) or len(values) != size:
+        raise BadRequest("Некорректный курсор страницы")
+    return values
+
+
+def after(fields, values):
+    """
+    Условие "строка после курсора" для сортировки по fields.
+
+    Раскрывает (a, b, c) > (x, y, z) в OR и добавляет a >= x, чтобы индекс
+    по первому полю ограничивал просмотр диапазоном.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(fields, values):
+        condition |= equal & Q(**{f"{field}__gt": value})
+        equal &= Q(**{field: value})
+    return Q(**{f"{fields[0]}__gte": values[0]}) & condition
+
+
+def keyset_page(queryset, fields, cursor=None, size=None):
+    # Одна страница после курсора; лишняя строка показывает, есть ли следующая (без COUNT)
+    size = size or settings.LIST_PAGE_SIZE
+    queryset = queryset.order_by(*fields)
+    if cursor:
+        try:
+            queryset = queryset.filter(after(fields, decode_cursor(cursor, len(fields))))
+        except (TypeError, ValueError, ValidationError):
+            # Значения курсора не подходят к типам полей сортировки
+            raise BadRequest("Некорректный курсор страницы")
+    rows = list(queryset[: size + 1])
+    if len(rows) <= size:
+        return KeysetPage(rows, None)
+    rows = rows[:size]
+    return KeysetPage(rows, encode_cursor([getattr(rows[-1], field) for field in fields]))
+
+
+class KeysetPaginationMixin:
+    """
+    Постраничный вывод ListView по курсору вместо номера страницы.
+
+    Страница выбирается условием по ключу сортировки keyset_fields (последнее
+    поле должно быть уникальным), поэтому любая страница стоит как первая.
+    Ссылка на следующую страницу - ?cursor=<next_cursor>.
+    """
+
+    keyset_fields = ("id",)
+    paginate_by = settings.LIST_PAGE_SIZE
+
+    def get_keyset_page(self, queryset, cursor):
+        return keyset_page(queryset, self.keyset_fields, cursor, self.paginate_by)
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get("cursor")
+        page = self.get_keyset_page(queryset, cursor)
+        self.cursor = cursor
+        self.next_cursor = page.next_cursor
+        return None, None, page.object_list, bool(cursor or page.next_cursor)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["cursor"] = self.cursor
+        context["next_cursor"] = self.next_cursor
+        return context
@@ -0,0 +1,142 @@
+import base64
+import re
+import time
+from email.header import Header
+from email.message import Message
+from email.parser import BytesHeaderParser
+from email.utils import formatdate, make_msgid
+
+from django.core.mail import EmailMessage
+from django.core.mail.message import DNS_NAME
+
+# Поля подстановки: {{ full_name }}, {{ email }}
+FIELD_RE = re.compile(r"{{\s*(full_name|email)\s*}}")
+
+# Длиннее 998 байт строка в 8bit-письме быть не может (RFC 5322)
+MAX_LINE_LENGTH = 998
+
+
+class CompiledTemplate:
+    """
+    Текст с полями подстановки, разобранный один раз.
+
+    Хранит чередующиеся куски текста и имена полей, так что подстановка
+    для получателя - это одна склейка строк.
+    """
+
+    def __init__(self, text):
+        parts = FIELD_RE.split(text)
+        self.literals = parts[0::2]
+        self.fields = parts[1::2]
+
+    @property
+    def is_static(self):
+        return not self.fields
+
+    def render(self, context):
+        if not self.fields:
+            return self.literals[0]
+        result = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            result.append(context[field])
+            result.append(literal)
+        return "".join(result)
+
+
+class PreparedMessage(Message):
+    """
+    email.message.Message поверх готового MIME-текста.
+
+    Заголовки разобраны и доступны как обычно, а as_bytes()/as_string()
+    возвращают исходные байты без повторной сериализации.
+    """
+
+    raw = b""
+
+    def as_bytes(self, unixfrom=False, linesep="\r\n", policy=None):
+        # Текст уже собран с CRLF, как его отправляет SMTP-бэкенд
+        return self.raw
+
+    def as_string(self, unixfrom=False, linesep="\r\n", maxheaderlen=0, policy=None):
+        return self.raw.decode()
+
+    def __bytes__(self):
+        return self.raw
+
+    def __str__(self):
+        return self.raw.decode()
+
+
+class PreparedEmail(EmailMessage):
+    """
+    Письмо с уже собранным MIME-текстом: бэкенды Django отправляют
+    результат message().as_bytes() без повторной сборки.
+    """
+
+    def __init__(self, raw, subject, body, from_email, to):
+        super().__init__(subject, body, from_email, to)
+        self.raw = raw
+
+    def message(self):
+        # Разбираются только заголовки; тело остается готовыми байтами
+        message = BytesHeaderParser(_class=PreparedMessage).parsebytes(self.raw)
+        message.raw = self.raw
+        return message
+
+
+class CompiledMessage:
+    """
+    Письмо рассылки, подготовленное один раз для всех получателей.
+
+    Шаблоны темы и текста разбираются при создании, постоянные заголовки
+    и закодированная тема (если в ней нет полей) собираются заранее. Для
+    каждого получателя подставляются только поля, To, Date и Message-ID.
+    """
+
+    def __init__(self, subject, body, from_email):
+        self.from_email = from_email
+        self.subject = CompiledTemplate(" ".join(subject.splitlines()))
+        self.body = CompiledTemplate(body.replace("\r\n", "\n").replace("\n", "\r\n"))
+        common = f"From: {from_email}\r\nMIME-Version: 1.0\r\nContent-Type: text/plain; charset=utf-8\r\n"
+        self.header_8bit = (common + "Content-Transfer-Encoding: 8bit\r\n").encode()
+        self.header_base64 = (common + "Content-Transfer-Encoding: base64\r\n").encode()
+        self.subject_header = self.encode_subject(self.subject.render({})) if self.subject.is_static else None
+        self.date = None
+        self.date_second = None
+
+    @staticmethod
+    def encode_subject(subject):
+        if subject.isascii():
+            return f"Subject: {subject}\r\n".encode()
+        return f"Subject: {Header(subject, 'utf-8').encode()}\r\n".encode()
+
+    def current_date(self):
+        # formatdate() дорогой, а точность до секунды достаточна
+        second = int(time.time())
+        if second != self.date_second:
+            self.date = f"Date: {formatdate(second, localtime=True)}\r\n".encode()
+            self.date_second = second
+        return self.date
+
+    def build(self, email, full_name=""):
+        # Значения полей не должны переносить строку: иначе это подмена заголовков
+        context = {"email": email, "full_name": " ".join((full_name or "").splitlines())}
+        subject = self.subject.render(context)
+        text = self.body.render(context)
+        body = text.encode()
+        if any(len(line) > MAX_LINE_LENGTH for line in body.split(b"\r\n")):
+            header = self.header_base64
+            body = base64.encodebytes(body).replace(b"\n", b"\r\n")
+        else:
+            header = self.header_8bit
+        raw = b"".join(
+            (
+                header,
+                self.subject_header or self.encode_subject(subject),
+                f"To: {email}\r\n".encode(),
+                self.current_date(),
+                f"Message-ID: {make_msgid(domain=DNS_NAME)}\r\n\r\n".encode(),
+                body,
+            )
+        )
+        return PreparedEmail(raw, subject, text, self.from_email, [email])
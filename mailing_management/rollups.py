@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import AttemptRollup, NewsletterAttempt, RollupCursor
+
+PERIODS = {
+    "hour": TruncHour,
+    "day": TruncDay,
+}
+
+
+def rollup_attempts(batch_size=None):
+    """
+    Учитывает в сводках AttemptRollup попытки, которых там еще нет.
+
+    Обрабатывает не больше ``batch_size`` попыток после сохраненной позиции.
+    Позиция блокируется SELECT ... FOR UPDATE SKIP LOCKED: если сводки
+    сейчас считает другой процесс, вызов ничего не делает. Свежие попытки
+    (моложе NEWSLETTER_ROLLUP_LAG секунд) откладываются до следующего раза,
+    чтобы не пропустить строки еще не зафиксированных транзакций.
+    Возвращает число учтенных попыток.
+    """
+    batch_size = batch_size or settings.NEWSLETTER_ROLLUP_BATCH
+    RollupCursor.objects.get_or_create(name="attempts")
+    with transaction.atomic():
+        cursor = RollupCursor.objects.select_for_update(skip_locked=True).filter(name="attempts").first()
+        if cursor is None:
+            return 0
+
+        cutoff = timezone.now() - timedelta(seconds=settings.NEWSLETTER_ROLLUP_LAG)
+        ids = list(
+            NewsletterAttempt.objects.filter(id__gt=cursor.last_id, attempt_date__lte=cutoff)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        attempts = NewsletterAttempt.objects.filter(id__gt=cursor.last_id, id__lte=ids[-1])
+
+        owners = set()
+        for period, trunc in PERIODS.items():
+            rows = (
+                attempts.annotate(bucket=trunc("attempt_date"))
+                .values("newsletter_id", "newsletter__owner_id", "bucket")
+                .annotate(
+                    successful=Count("id", filter=Q(status="successful")),
+                    failed=Count("id", filter=Q(status="failed")),
+                )
+                .order_by()
+            )
+            rows = list(rows)
+            owners.update(row["newsletter__owner_id"] for row in rows)
+            merge_rollups(period, rows)
+
+        cursor.last_id = ids[-1]
+        cursor.save(update_fields=["last_id"])
+        # Статистика владельцев читает сводки - сбрасываем ее кеш
+        transaction.on_commit(lambda: [bump_version(f"owner-stats:{owner_id}") for owner_id in owners])
+    return len(ids)
+
+
+def merge_rollups(period, rows):
+    # Прибавляет посчитанные строки к сводкам; вызывается под блокировкой курсора
+    rows = {(row["newsletter_id"], row["bucket"]): row for row in rows}
+    if not rows:
+        return
+    existing = AttemptRollup.objects.filter(
+        period=period,
+        newsletter_id__in={newsletter_id for newsletter_id, bucket in rows},
+        bucket__in={bucket for newsletter_id, bucket in rows},
+    )
+    changed = []
+    for rollup in existing:
+        row = rows.pop((rollup.newsletter_id, rollup.bucket), None)
+        if row is not None:
+            rollup.successful += row["successful"]
+            rollup.failed += row["failed"]
+            changed.append(rollup)
+    AttemptRollup.objects.bulk_update(changed, ["successful", "failed"])
+    AttemptRollup.objects.bulk_create(
+        AttemptRollup(
+            newsletter_id=newsletter_id,
+            owner_id=row["newsletter__owner_id"],
+            period=period,
+            bucket=bucket,
+            successful=row["successful"],
+            failed=row["failed"],
+        )
+        for (newsletter_id, bucket), row in rows.items()
+    )
@@ -1,7 +1,35 @@
 # services.py
-from .models import MailingClient, MessageManagement, Newsletter, NewsletterAttempt, NewsletterStatistics
-from django.core.mail import send_mail
+import smtplib
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import groupby, islice
+from operator import attrgetter
+
+from .models import (
+    AttemptRollup,
+    MailingClient,
+    MessageManagement,
+    Newsletter,
+    NewsletterAttempt,
+    NewsletterDelivery,
+    NewsletterStatistics,
+    SiteCounter,
+)
+from django.core.mail import get_connection
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, Min, OuterRef, Q, Sum
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from .caching import bump_version, get_version, versioned_key
+from .pagination import keyset_page
+from .personalization import CompiledMessage
+from .throttling import NoRateLimit, get_rate_limiter, is_temporary, retry_delay
 
 
 class ClientService:
@@ -22,42 +50,542 @@ class MessageService:
         return messages
 
 
-class NewsletterService:
+class SMTPSession:
+    """
+    Одно SMTP-соединение, переиспользуемое для отправки многих писем.
+
+    После ``batch_size`` писем сессия переоткрывается (многие серверы
+    ограничивают число писем на одно соединение), а при обрыве связи
+    сервером письмо повторяется через новое соединение.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.NEWSLETTER_BATCH_SIZE
+        self.connection = None
+        self.sent_in_session = 0
+
+    def open(self):
+        self.connection = get_connection(fail_silently=False)
+        self.connection.open()
+        self.sent_in_session = 0
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except smtplib.SMTPException:
+                pass
+            self.connection = None
+
+    def send(self, message):
+        # Новая пачка - новое соединение
+        if self.connection is None or self.sent_in_session >= self.batch_size:
+            self.close()
+            self.open()
+        try:
+            self.connection.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            # Сервер закрыл сессию - переподключаемся и повторяем письмо один раз
+            self.close()
+            self.open()
+            self.connection.send_messages([message])
+        self.sent_in_session += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-    @staticmethod
-    def get_newsletter_list(newsletter_id):
-        # Получаем все продукты в указанной категории
-        newsletters = Newsletter.objects.filter(id=newsletter_id)
-        return newsletters
 
+def compile_message(message):
+    # Письмо рассылки собирается один раз, для получателя подставляются только поля
+    return CompiledMessage(message.subject, message.body, settings.DEFAULT_FROM_EMAIL)
 
-def send_newsletter(newsletter):
-    subject = newsletter.message.subject
-    body = newsletter.message.body
-    clients = [client.email for client in newsletter.clients.all()]
 
-    # Получаем статистику рассылки или создаем новую
-    stats, created = NewsletterStatistics.objects.get_or_create(newsletter=newsletter)
+# Результат неудачной отправки; temporary - отказ, который стоит повторить позже
+SendError = namedtuple("SendError", ["message", "temporary"])
 
-    for client in clients:
+
+def deliver(session, message, recipient, limiter=None):
+    # Отправляет одно письмо; возвращает SendError или None при успехе
+    limiter = limiter or NoRateLimit()
+    limiter.acquire()
+    try:
+        email, full_name = recipient
+        session.send(message.build(email, full_name))
+    except Exception as e:
+        temporary = is_temporary(e)
+        if temporary:
+            # Сервер просит притормозить - снижаем скорость
+            limiter.penalize()
+        # Полный текст исключения в журнале не нужен, храним начало
+        return SendError(str(e)[: settings.NEWSLETTER_ERROR_MAX_LENGTH], temporary)
+    limiter.reward()
+    return None
+
+
+class ConcurrentSender:
+    """
+    Пул потоков для параллельной отправки: у каждого потока своя SMTPSession.
+
+    Потоки занимаются только SMTP, запись результатов в базу остается в
+    вызывающем потоке. При ``workers=1`` письма отправляются в текущем
+    потоке. Соединения живут до вызова ``close()``.
+
+    В работе одновременно не больше ``workers * window_per_worker`` писем:
+    если вызывающий цикл прервется, отправленными без записанного результата
+    окажутся только они, а не вся пачка получателей.
+    """
+
+    window_per_worker = 2
+
+    def __init__(self, workers=None, batch_size=None, limiter=None):
+        self.workers = max(1, min(workers or settings.NEWSLETTER_WORKERS, settings.NEWSLETTER_MAX_WORKERS))
+        self.batch_size = batch_size
+        # Ограничение скорости общее для всех потоков
+        self.limiter = limiter or get_rate_limiter()
+        self.local = threading.local()
+        self.sessions = []
+        self.executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = SMTPSession(self.batch_size)
+            self.sessions.append(session)
+        return session
+
+    def send_all(self, message, recipients):
+        # recipients - пары (email, full_name); возвращает пары (получатель,
+        # ошибка или None) в том же порядке
+        def task(recipient):
+            return recipient, deliver(self.session(), message, recipient, self.limiter)
+
+        if self.executor is None:
+            return map(task, recipients)
+        return self.submit_window(task, recipients)
+
+    def submit_window(self, task, recipients):
+        # Как executor.map, но новые письма ставятся в пул по мере получения результатов
+        window = self.workers * self.window_per_worker
+        pending = deque()
         try:
-            send_mail(
-                subject,
-                body,
-                settings.DEFAULT_FROM_EMAIL,
-                [client],
+            for recipient in recipients:
+                pending.append(self.executor.submit(task, recipient))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self, cancel=False):
+        if self.executor is not None:
+            # При ошибке еще не начатые отправки отменяются
+            self.executor.shutdown(cancel_futures=cancel)
+        for session in self.sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+
+class AttemptBuffer:
+    """
+    Копит результаты отправки в памяти и сбрасывает их в базу пачками.
+
+    Сброс происходит каждые ``size`` писем или ``interval`` секунд: попытки
+    пишутся одним bulk_create, счетчики статистики - одним UPSERT, а
+    состояние NewsletterDelivery получателей - несколькими UPDATE по client_id.
+    При падении процесса теряется не больше одного буфера.
+
+    Временные отказы (4xx) не считаются неудачей: задание возвращается в
+    очередь с экспоненциальной паузой, пока не кончатся повторы.
+
+    ``create_deliveries`` нужен синхронной отправке, у которой заданий в
+    очереди еще нет: недостающие строки создаются при сбросе.
+    """
+
+    def __init__(self, newsletter, size=None, interval=None, create_deliveries=False):
+        self.newsletter = newsletter
+        self.size = size or settings.NEWSLETTER_FLUSH_SIZE
+        self.interval = interval or settings.NEWSLETTER_FLUSH_INTERVAL
+        self.create_deliveries = create_deliveries
+        self.results = []
+        self.flushed_at = time.monotonic()
+
+    def add(self, client_id, error):
+        self.results.append((client_id, error))
+        if len(self.results) >= self.size or time.monotonic() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.results:
+            with transaction.atomic():
+                self.write(self.results)
+        self.results = []
+        self.flushed_at = time.monotonic()
+
+    def write(self, results):
+        now = timezone.now()
+        deliveries = NewsletterDelivery.objects.filter(newsletter=self.newsletter)
+        if self.create_deliveries:
+            NewsletterDelivery.objects.bulk_create(
+                [NewsletterDelivery(newsletter=self.newsletter, client_id=client_id) for client_id, error in results],
+                ignore_conflicts=True,
             )
-            # Создаем запись об успешной попытке
-            NewsletterAttempt.objects.create(status="successful", newsletter=newsletter)
 
-            # Обновляем статистику
-            stats.update_statistics(success=True)
+        # Временные отказы с неисчерпанными повторами уходят в расписание повторов
+        temporary = [client_id for client_id, error in results if error is not None and error.temporary]
+        retries = {}
+        if temporary:
+            retries = dict(
+                deliveries.filter(
+                    client_id__in=temporary, attempts__lt=settings.NEWSLETTER_MAX_RETRIES - 1
+                ).values_list("client_id", "attempts")
+            )
+
+        attempts = []
+        sent = []
+        failed = defaultdict(list)
+        rescheduled = defaultdict(list)
+        for client_id, error in results:
+            if error is None:
+                attempts.append(
+                    NewsletterAttempt(status="successful", newsletter=self.newsletter, client_id=client_id)
+                )
+                sent.append(client_id)
+            elif client_id in retries:
+                rescheduled[(retries[client_id], error.message)].append(client_id)
+            else:
+                attempts.append(
+                    NewsletterAttempt(
+                        status="failed",
+                        server_response=error.message,
+                        newsletter=self.newsletter,
+                        client_id=client_id,
+                    )
+                )
+                failed[error.message].append(client_id)
+
+        NewsletterAttempt.objects.bulk_create(attempts)
+        NewsletterStatistics.apply_deltas({self.newsletter.id: (len(sent), len(attempts) - len(sent))})
+        # Кеш статистики владельца сбрасывается после фиксации транзакции
+        owner_id = self.newsletter.owner_id
+        transaction.on_commit(lambda: bump_version(f"owner-stats:{owner_id}"))
+        if sent:
+            deliveries.filter(client_id__in=sent).update(
+                status="sent", attempts=F("attempts") + 1, locked_at=None, last_error=None
+            )
+        # Ошибок обычно немного разных, поэтому UPDATE на каждый текст ошибки
+        for message, client_ids in failed.items():
+            deliveries.filter(client_id__in=client_ids).update(
+                status="failed", attempts=F("attempts") + 1, locked_at=None, last_error=message
+            )
+        for (tries, message), client_ids in rescheduled.items():
+            deliveries.filter(client_id__in=client_ids).update(
+                status="pending",
+                attempts=F("attempts") + 1,
+                available_at=now + timedelta(seconds=retry_delay(tries)),
+                locked_at=None,
+                last_error=message,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+def not_delivered(clients, newsletter):
+    # Получатели без успешной доставки; NOT EXISTS идет по уникальному индексу (newsletter, client)
+    delivered = NewsletterDelivery.objects.filter(newsletter=newsletter, client=OuterRef("pk"), status="sent")
+    return clients.filter(~Exists(delivered))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
-        except Exception as e:
-            # Создаем запись о неуспешной попытке
-            NewsletterAttempt.objects.create(
-                status="failed", server_response=str(e), newsletter=newsletter
+
+def stream_recipients(clients, chunk_size=None):
+    """
+    Отдает получателей порциями (id, email, full_name), не загружая весь список.
+
+    На PostgreSQL iterator() читает через серверный курсор, поэтому память
+    не зависит от размера рассылки, а отправка начинается сразу.
+    """
+    chunk_size = chunk_size or settings.NEWSLETTER_RECIPIENT_CHUNK
+    rows = clients.order_by().values_list("id", "email", "full_name").iterator(chunk_size=chunk_size)
+    return chunked(rows, chunk_size)
+
+
+def shard_clients(clients, shards, shard_index):
+    # Детерминированно делит получателей на shards частей по id
+    if shards <= 1:
+        return clients
+    return clients.annotate(shard=Mod("id", shards)).filter(shard=shard_index)
+
+
+def send_newsletter(newsletter, batch_size=None, workers=None, shards=1, shard_index=0, resume=False):
+    """
+    Синхронная отправка рассылки в текущем процессе.
+
+    При ``shards > 1`` отправляется только часть получателей с
+    ``id % shards == shard_index``, поэтому разные процессы или хосты могут
+    делить одну рассылку без повторных писем. Статистика всех частей
+    сходится в одной строке NewsletterStatistics через атомарные инкременты.
+
+    С ``resume=True`` письма получают только те, кому рассылка еще не
+    доставлена успешно, - так прерванную отправку можно продолжить.
+    """
+    message = compile_message(newsletter.message)
+    clients = shard_clients(newsletter.clients.all(), shards, shard_index)
+    if resume:
+        clients = not_delivered(clients, newsletter)
+
+    # Попытки, статистика и состояние доставки пишутся в базу пачками
+    with AttemptBuffer(newsletter, create_deliveries=True) as attempts, ConcurrentSender(
+        workers, batch_size
+    ) as sender:
+        for chunk in stream_recipients(clients):
+            results = sender.send_all(message, [(email, full_name) for client_id, email, full_name in chunk])
+            for (client_id, email, full_name), (_, error) in zip(chunk, results):
+                attempts.add(client_id, error)
+
+
+def enqueue_newsletter(newsletter, resume=False):
+    """
+    Ставит рассылку в очередь: по заданию NewsletterDelivery на получателя.
+
+    Уже существующие задания (кроме взятых в работу) снова становятся
+    ожидающими; с ``resume=True`` успешно доставленные не трогаются и
+    повторно не отправляются. Возвращает число заданий в очереди.
+    """
+    NewsletterStatistics.objects.get_or_create(newsletter=newsletter)
+    with transaction.atomic():
+        change_status(Newsletter.objects.filter(pk=newsletter.pk), "started")
+        existing = NewsletterDelivery.objects.filter(newsletter=newsletter).exclude(status="processing")
+        if resume:
+            existing = existing.exclude(status="sent")
+        existing.update(
+            status="pending", attempts=0, available_at=timezone.now(), locked_at=None, last_error=None
+        )
+        # Новые задания создаются в базе одним запросом, сколько бы ни было получателей
+        NewsletterDelivery.enqueue_recipients(newsletter.pk)
+    return newsletter.deliveries.filter(status="pending").count()
+
+
+def release_stale_deliveries():
+    # Возвращает в очередь задания, зависшие у упавшего воркера
+    lease_expired = timezone.now() - timedelta(seconds=settings.MAIL_WORKER_LEASE)
+    return NewsletterDelivery.objects.filter(status="processing", locked_at__lt=lease_expired).update(
+        status="pending", locked_at=None
+    )
+
+
+def claim_deliveries(limit):
+    """
+    Забирает до ``limit`` готовых заданий и помечает их как взятые в работу.
+
+    SELECT ... FOR UPDATE SKIP LOCKED позволяет нескольким воркерам разбирать
+    очередь одновременно, не получая одни и те же задания.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            NewsletterDelivery.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(status="pending", available_at__lte=now)
+            # Остановленные и завершенные рассылки не отправляются, даже если задания остались
+            .filter(newsletter__status="started")
+            # После end_date рассылка больше не отправляется
+            .filter(Q(newsletter__end_date__isnull=True) | Q(newsletter__end_date__gt=now))
+            .order_by("available_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        NewsletterDelivery.objects.filter(id__in=ids).update(status="processing", locked_at=now)
+    return list(
+        NewsletterDelivery.objects.filter(id__in=ids)
+        .select_related("newsletter__message", "client")
+        .order_by("newsletter_id", "id")
+    )
+
+
+def process_deliveries(deliveries, sender):
+    # Отправляет взятые задания и записывает результаты
+    for newsletter, group in groupby(deliveries, key=attrgetter("newsletter")):
+        group = list(group)
+        recipients = [(delivery.client.email, delivery.client.full_name) for delivery in group]
+        message = compile_message(newsletter.message)
+        # Состояние заданий обновляет AttemptBuffer при сбросе
+        with AttemptBuffer(newsletter) as attempts:
+            results = sender.send_all(message, recipients)
+            for delivery, (recipient, error) in zip(group, results):
+                attempts.add(delivery.client_id, error)
+
+
+def change_status(newsletters, status):
+    """
+    Меняет статус рассылок одним UPDATE и возвращает id измененных.
+
+    UPDATE минует сигналы, поэтому счетчик активных рассылок для главной
+    страницы правится здесь же. Строки блокируются, так что параллельные
+    вызовы не изменят одну рассылку дважды.
+    """
+    with transaction.atomic():
+        changed = dict(newsletters.exclude(status=status).select_for_update().values_list("id", "status"))
+        if changed:
+            Newsletter.objects.filter(id__in=changed).update(status=status)
+            was_active = sum(1 for old_status in changed.values() if old_status == "started")
+            now_active = len(changed) if status == "started" else 0
+            SiteCounter.add(SiteCounter.ACTIVE_NEWSLETTERS, now_active - was_active)
+    return list(changed)
+
+
+def finish_newsletters(newsletters, reason):
+    # Завершает рассылки и снимает с очереди их неотправленные задания
+    with transaction.atomic():
+        ids = change_status(newsletters, "finished")
+        if ids:
+            NewsletterDelivery.objects.filter(newsletter_id__in=ids, status="pending").update(
+                status="failed", last_error=reason
             )
+    return len(ids)
+
+
+def run_scheduler_tick(now=None):
+    """
+    Один проход планировщика рассылок.
+
+    Завершает рассылки с истекшим end_date и полностью отправленные,
+    запускает рассылки, у которых наступил beginning_date. Возвращает
+    время следующего запланированного события или None.
+    """
+    now = now or timezone.now()
+    expired = Newsletter.objects.filter(status__in=["created", "started"], end_date__lte=now)
+    finish_newsletters(expired, "Срок рассылки истек")
+
+    # Запуск: условный UPDATE под блокировкой гарантирует, что рассылку запустит один планировщик
+    due = Newsletter.objects.filter(status="created", beginning_date__lte=now).order_by("beginning_date")
+    for newsletter in due.select_related("message"):
+        # Запуск и постановка в очередь - одна транзакция: иначе при падении между ними
+        # рассылка осталась бы запущенной без заданий и следующий проход завершил бы ее
+        with transaction.atomic():
+            if change_status(Newsletter.objects.filter(pk=newsletter.pk, status="created"), "started"):
+                # Уже доставленным (например, через send_newsletter --sync) повторно не шлем
+                enqueue_newsletter(newsletter, resume=True)
+
+    in_queue = NewsletterDelivery.objects.filter(
+        newsletter=OuterRef("pk"), status__in=["pending", "processing"]
+    )
+    finish_newsletters(
+        Newsletter.objects.filter(status="started").filter(~Exists(in_queue)), "Рассылка завершена"
+    )
+
+    upcoming = Newsletter.objects.filter(status="created", beginning_date__gt=now).aggregate(
+        next_start=Min("beginning_date")
+    )["next_start"]
+    ending = Newsletter.objects.filter(status__in=["created", "started"], end_date__gt=now).aggregate(
+        next_end=Min("end_date")
+    )["next_end"]
+    return min((moment for moment in (upcoming, ending) if moment), default=None)
+
+
+def get_owner_statistics(owner):
+    """
+    Статистика всех рассылок владельца.
+
+    Таблица по рассылкам - один запрос к NewsletterStatistics с join, разбивка
+    по дням за последние дни - один сгруппированный запрос к сводкам
+    AttemptRollup. Результат кешируется до записи новых попыток.
+    """
+    key = versioned_key(f"owner-stats:{owner.pk}")
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    newsletters = list(
+        NewsletterStatistics.objects.filter(newsletter__owner=owner)
+        .values(
+            "newsletter_id",
+            "newsletter__status",
+            "newsletter__message__subject",
+            "total_sent",
+            "successful_attempts",
+            "failed_attempts",
+            "last_update",
+        )
+        .order_by("-newsletter_id")
+    )
+    since = timezone.now() - timedelta(days=settings.STATISTICS_DAYS)
+    days = list(
+        AttemptRollup.objects.filter(owner=owner, period="day", bucket__gte=since)
+        .values("bucket")
+        .annotate(successful=Sum("successful"), failed=Sum("failed"))
+        .order_by("-bucket")
+    )
+    stats = {
+        "newsletters": newsletters,
+        "days": days,
+        "total_sent": sum(row["total_sent"] for row in newsletters),
+        "successful_attempts": sum(row["successful_attempts"] for row in newsletters),
+        "failed_attempts": sum(row["failed_attempts"] for row in newsletters),
+        "last_update": max((row["last_update"] for row in newsletters), default=None),
+    }
+    cache.set(key, stats, timeout=settings.STATISTICS_CACHE_TIMEOUT)
+    return stats
+
+
+# email уникален, поэтому сортировка по нему совпадает с ordering (email, full_name)
+CLIENT_KEYSET = ("email",)
+
+
+def client_list_version(user):
+    # Менеджеры видят всех получателей и делят один ключ, пользователи - только своих
+    return "clients:all" if user.is_staff else f"clients:{user.pk}"
+
+
+def visible_clients(user):
+    queryset = MailingClient.objects.all()
+    if user.is_staff:
+        return queryset  # Менеджеры могут видеть все
+    return queryset.filter(owner=user)  # Пользователи видят только свои
+
+
+def get_client_page(user, cursor=None):
+    """
+    Страница получателей, которых видит пользователь, из кеша.
+
+    Ключ включает курсор страницы и версию, которую сигналы MailingClient
+    увеличивают при любом изменении получателя - у владельца и у общего
+    списка менеджеров.
+    """
+    key = versioned_key(client_list_version(user), cursor or "first")
+    page = cache.get(key)
+    if page is None:
+        page = keyset_page(visible_clients(user), CLIENT_KEYSET, cursor)
+        cache.set(key, page, settings.CLIENT_LIST_CACHE_TIMEOUT)
+    return page
+
+
+def get_recipient_count(newsletter):
+    # Число получателей рассылки; сбрасывается при изменении состава и при удалении клиентов
+    key = versioned_key(f"newsletter-recipients:{newsletter.pk}", get_version("clients:all"))
+    count = cache.get(key)
+    if count is None:
+        count = newsletter.clients.count()
+        cache.set(key, count, settings.CLIENT_LIST_CACHE_TIMEOUT)
+    return count
+
 
-            # Обновляем статистику
-            stats.update_statistics(success=False)
+def get_recipient_page(newsletter, cursor=None):
+    # Страница получателей рассылки по курсору, только нужные для таблицы поля
+    clients = newsletter.clients.only("id", "email", "full_name")
+    return keyset_page(clients, CLIENT_KEYSET, cursor, settings.RECIPIENT_PAGE_SIZE)
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_version
+from .models import MailingClient, Newsletter, SiteCounter
+
+
+def invalidate_client_lists(*owner_ids):
+    # Сбрасываем кеш списков получателей владельцев и общий список менеджеров после фиксации
+    names = {"clients:all", *(f"clients:{owner_id}" for owner_id in owner_ids if owner_id)}
+    transaction.on_commit(lambda: [bump_version(name) for name in names])
+
+
+@receiver(post_save, sender=Newsletter)
+def newsletter_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_status = getattr(instance, "loaded_status", None)
+    if created:
+        SiteCounter.add(SiteCounter.TOTAL_NEWSLETTERS, 1)
+        if instance.status == "started":
+            SiteCounter.add(SiteCounter.ACTIVE_NEWSLETTERS, 1)
+    elif old_status is not None and old_status != instance.status:
+        if instance.status == "started":
+            SiteCounter.add(SiteCounter.ACTIVE_NEWSLETTERS, 1)
+        elif old_status == "started":
+            SiteCounter.add(SiteCounter.ACTIVE_NEWSLETTERS, -1)
+    instance.loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Newsletter)
+def newsletter_deleted(sender, instance, **kwargs):
+    SiteCounter.add(SiteCounter.TOTAL_NEWSLETTERS, -1)
+    if instance.status == "started":
+        SiteCounter.add(SiteCounter.ACTIVE_NEWSLETTERS, -1)
+
+
+@receiver(post_save, sender=MailingClient)
+def client_saved(sender, instance, created, raw=False, **kwargs):
+    # email у получателя уникален, поэтому уникальных адресов столько же, сколько получателей
+    if created and not raw:
+        SiteCounter.add(SiteCounter.UNIQUE_RECIPIENTS, 1)
+    # При смене владельца получатель пропадает из списка прежнего владельца
+    invalidate_client_lists(instance.owner_id, getattr(instance, "loaded_owner_id", None))
+    instance.loaded_owner_id = instance.owner_id
+
+
+@receiver(post_delete, sender=MailingClient)
+def client_deleted(sender, instance, **kwargs):
+    SiteCounter.add(SiteCounter.UNIQUE_RECIPIENTS, -1)
+    invalidate_client_lists(instance.owner_id, getattr(instance, "loaded_owner_id", None))
+
+
+@receiver(m2m_changed, sender=Newsletter.clients.through)
+def newsletter_clients_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Сбрасываем кешированное число получателей у затронутых рассылок
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        newsletter_ids = [instance.pk]
+    elif pk_set is not None:
+        newsletter_ids = list(pk_set)
+    else:
+        # clear() со стороны клиента: рассылки уже не найти, сбрасываем через версию списка
+        newsletter_ids = []
+        invalidate_client_lists(instance.owner_id)
+    transaction.on_commit(
+        lambda: [bump_version(f"newsletter-recipients:{newsletter_id}") for newsletter_id in newsletter_ids]
+    )
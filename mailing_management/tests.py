@@ -1,3 +1,866 @@
-from django.test import TestCase
+import base64
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+from datetime import timedelta
+from email.header import decode_header, make_header
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from mailing_management.caching import bump_version, get_version
+from mailing_management.models import (
+    MailingClient,
+    MessageManagement,
+    Newsletter,
+    NewsletterAttempt,
+    NewsletterDelivery,
+    NewsletterStatistics,
+)
+from mailing_management.pagination import encode_cursor, keyset_page
+from mailing_management.personalization import CompiledMessage
+from mailing_management.services import (
+    AttemptBuffer,
+    ConcurrentSender,
+    SendError,
+    claim_deliveries,
+    enqueue_newsletter,
+    get_client_page,
+    release_stale_deliveries,
+    run_scheduler_tick,
+)
+from mailing_management.throttling import (
+    AdaptiveBackoff,
+    NoRateLimit,
+    SharedRateLimiter,
+    TokenBucket,
+    get_rate_limiter,
+    is_temporary,
+)
+from mailing_management.tiered_cache import SharedFileCache
+from mailing_management.views import MessageListView
+from users.models import CustomUser
+
+# Тесты очищают кеш, поэтому общий кеш подменяется временным каталогом:
+# настоящий (BASE_DIR/cache или Redis) остается нетронутым
+_test_caches = None
+
+
+def setUpModule():
+    global _test_caches
+    location = tempfile.mkdtemp(prefix="mailing-tests-cache-")
+    shared = {"BACKEND": "mailing_management.tiered_cache.SharedFileCache", "LOCATION": location, "TIMEOUT": None}
+    _test_caches = override_settings(CACHES={**settings.CACHES, "shared": shared})
+    _test_caches.enable()
+
+
+def tearDownModule():
+    location = settings.CACHES["shared"]["LOCATION"]
+    caches["default"].clear()
+    _test_caches.disable()
+    shutil.rmtree(location, ignore_errors=True)
+
 
 # Create your tests here.
+class NewsletterStatisticsCountersTest(TransactionTestCase):
+    # Потоки работают со своими соединениями, поэтому нужна настоящая фиксация транзакций
+
+    threads = 8
+    increments = 50
+
+    def setUp(self):
+        message = MessageManagement.objects.create(subject="Тема", body="Текст")
+        self.first = Newsletter.objects.create(message=message)
+        self.second = Newsletter.objects.create(message=message)
+
+    def run_in_threads(self, target):
+        start = threading.Barrier(self.threads)
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.increments):
+                    target()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_increments_are_not_lost(self):
+        self.run_in_threads(lambda: NewsletterStatistics.increment(self.first.id, successful=1))
+
+        stats = NewsletterStatistics.objects.get(newsletter=self.first)
+        self.assertEqual(stats.successful_attempts, self.threads * self.increments)
+        self.assertEqual(stats.total_sent, self.threads * self.increments)
+        self.assertEqual(stats.failed_attempts, 0)
+
+    def test_concurrent_update_statistics_on_stale_objects(self):
+        stats = NewsletterStatistics.objects.create(newsletter=self.first)
+
+        # Каждый поток держит свою, быстро устаревающую копию строки
+        def update():
+            NewsletterStatistics.objects.get(pk=stats.pk).update_statistics(success=False)
+
+        self.run_in_threads(update)
+
+        stats.refresh_from_db()
+        self.assertEqual(stats.failed_attempts, self.threads * self.increments)
+        self.assertEqual(stats.total_sent, self.threads * self.increments)
+
+    def test_concurrent_multi_newsletter_deltas(self):
+        self.run_in_threads(
+            lambda: NewsletterStatistics.apply_deltas(
+                {self.first.id: (2, 1), self.second.id: (0, 3)}
+            )
+        )
+
+        total = self.threads * self.increments
+        first = NewsletterStatistics.objects.get(newsletter=self.first)
+        second = NewsletterStatistics.objects.get(newsletter=self.second)
+        self.assertEqual(
+            (first.successful_attempts, first.failed_attempts, first.total_sent),
+            (2 * total, total, 3 * total),
+        )
+        self.assertEqual(
+            (second.successful_attempts, second.failed_attempts, second.total_sent),
+            (0, 3 * total, 3 * total),
+        )
+
+
+class NewsletterStatisticsDeltasTest(TestCase):
+    def test_apply_deltas_uses_one_query(self):
+        message = MessageManagement.objects.create(subject="Тема", body="Текст")
+        newsletters = [Newsletter.objects.create(message=message) for _ in range(5)]
+
+        with self.assertNumQueries(1):
+            NewsletterStatistics.apply_deltas({newsletter.id: (1, 1) for newsletter in newsletters})
+
+        self.assertEqual(
+            list(NewsletterStatistics.objects.values_list("total_sent", flat=True)), [2] * 5
+        )
+
+    def test_apply_deltas_orders_rows_by_newsletter(self):
+        # Одинаковый порядок строк в параллельных UPSERT исключает взаимную блокировку
+        message = MessageManagement.objects.create(subject="Тема", body="Текст")
+        first, second = Newsletter.objects.create(message=message), Newsletter.objects.create(message=message)
+        with CaptureQueriesContext(connection) as queries:
+            NewsletterStatistics.apply_deltas({second.id: (1, 0), first.id: (0, 1)})
+        self.assertLess(queries[0]["sql"].index(f"({first.id}, "), queries[0]["sql"].index(f"({second.id}, "))
+
+    def test_update_statistics_without_newsletter_keeps_one_row(self):
+        stats = NewsletterStatistics.objects.create()
+        stats.update_statistics(success=True)
+        stats.update_statistics(success=False)
+        self.assertEqual(NewsletterStatistics.objects.count(), 1)
+        self.assertEqual((stats.total_sent, stats.successful_attempts, stats.failed_attempts), (2, 1, 1))
+
+    def test_apply_deltas_rejects_missing_newsletter(self):
+        with self.assertRaises(ValueError):
+            NewsletterStatistics.apply_deltas({None: (1, 0)})
+
+
+class CompiledMessageTest(SimpleTestCase):
+    def setUp(self):
+        self.compiled = CompiledMessage(
+            "Привет, {{ full_name }}", "Письмо для {{ full_name }} <{{ email }}>", "from@example.com"
+        )
+
+    def test_fields_are_substituted(self):
+        email = self.compiled.build("to@example.com", "Иван")
+        self.assertEqual(email.subject, "Привет, Иван")
+        self.assertEqual(email.body, "Письмо для Иван <to@example.com>")
+        message = email.message()
+        self.assertEqual(message["To"], "to@example.com")
+        self.assertIn("Письмо для Иван <to@example.com>".encode(), bytes(message))
+
+    def test_subject_is_rfc2047_encoded(self):
+        message = self.compiled.build("to@example.com", "Иван").message()
+        self.assertTrue(message["Subject"].startswith("=?utf-8?"))
+        self.assertEqual(str(make_header(decode_header(message["Subject"]))), "Привет, Иван")
+        # Заголовки письма - только ASCII, кириллица есть лишь в теле
+        self.assertTrue(message.as_bytes().split(b"\r\n\r\n", 1)[0].isascii())
+
+    def test_newlines_in_full_name_do_not_inject_headers(self):
+        message = self.compiled.build("to@example.com", "Иван\r\nBcc: spy@example.com").message()
+        self.assertIsNone(message["Bcc"])
+        self.assertEqual(message.keys().count("Subject"), 1)
+
+    def test_long_lines_fall_back_to_base64(self):
+        compiled = CompiledMessage("Тема", "x" * 2000, "from@example.com")
+        message = compiled.build("to@example.com").message()
+        self.assertEqual(message["Content-Transfer-Encoding"], "base64")
+        body = message.as_bytes().split(b"\r\n\r\n", 1)[1]
+        self.assertEqual(base64.b64decode(body), b"x" * 2000)
+        self.assertTrue(all(len(line) <= 998 for line in message.as_bytes().split(b"\r\n")))
+
+    def test_send_through_console_and_locmem_backends(self):
+        email = self.compiled.build("to@example.com", "Иван")
+        stream = StringIO()
+        console = get_connection("django.core.mail.backends.console.EmailBackend", stream=stream)
+        self.assertEqual(console.send_messages([email]), 1)
+        self.assertIn("To: to@example.com", stream.getvalue())
+        locmem = get_connection("django.core.mail.backends.locmem.EmailBackend")
+        self.assertEqual(locmem.send_messages([email]), 1)
+        self.assertEqual(mail.outbox[-1].to, ["to@example.com"])
+
+
+class ConcurrentSenderTest(SimpleTestCase):
+    def test_interrupted_loop_does_not_send_whole_chunk(self):
+        message = CompiledMessage("Тема", "Текст", "from@example.com")
+        recipients = [(f"to{i}@example.com", "") for i in range(400)]
+        sender = ConcurrentSender(workers=4, limiter=NoRateLimit())
+        with self.assertRaises(KeyboardInterrupt):
+            with sender:
+                for i, result in enumerate(sender.send_all(message, recipients)):
+                    if i == 5:
+                        raise KeyboardInterrupt
+        # Отправлены только письма из окна, результаты которых еще не прочитаны
+        self.assertLessEqual(len(mail.outbox), 6 + sender.workers * sender.window_per_worker)
+
+
+class ThrottlingTest(SimpleTestCase):
+    def test_token_bucket_allows_burst_then_waits(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        with mock.patch("mailing_management.throttling.time.sleep") as sleep:
+            for _ in range(3):
+                bucket.acquire()
+            sleep.assert_not_called()
+            # Токены кончились: следующее письмо ждет, пока накопится новый
+            sleep.side_effect = lambda seconds: setattr(bucket, "tokens", 1)
+            bucket.acquire()
+        self.assertAlmostEqual(sleep.call_args.args[0], 0.1, delta=0.01)
+
+    def test_penalize_and_reward_adjust_rate(self):
+        bucket = TokenBucket(rate=10)
+        bucket.penalize()
+        self.assertEqual(bucket.rate, 5)
+        for _ in range(10):
+            bucket.penalize()
+        # Не ниже NEWSLETTER_RATE_MIN_FACTOR от лимита
+        self.assertAlmostEqual(bucket.rate, 10 * settings.NEWSLETTER_RATE_MIN_FACTOR)
+        for _ in range(100):
+            bucket.reward()
+        self.assertEqual(bucket.rate, 10)
+
+    def test_backoff_without_rate_limit(self):
+        limiter = get_rate_limiter()
+        self.assertIsInstance(limiter, AdaptiveBackoff)
+        with mock.patch("mailing_management.throttling.time.sleep") as sleep:
+            limiter.acquire()
+            limiter.acquire()
+            sleep.assert_not_called()
+            limiter.penalize()
+            limiter.penalize()
+            self.assertEqual(limiter.delay, 2 * settings.NEWSLETTER_BACKOFF_DELAY)
+            limiter.acquire()
+            limiter.acquire()
+            self.assertGreater(sleep.call_args.args[0], 0)
+        # Успешные письма постепенно снимают паузу совсем
+        for _ in range(200):
+            limiter.reward()
+        self.assertEqual(limiter.delay, 0)
+
+    def test_is_temporary(self):
+        cases = [
+            (smtplib.SMTPResponseException(421, b"Try again later"), True),
+            (smtplib.SMTPResponseException(550, b"Mailbox unavailable"), False),
+            (smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"Busy")}), True),
+            (
+                smtplib.SMTPRecipientsRefused(
+                    {"a@example.com": (450, b"Busy"), "b@example.com": (550, b"No")}
+                ),
+                False,
+            ),
+            (smtplib.SMTPServerDisconnected(), True),
+            (smtplib.SMTPException(), False),
+            (TimeoutError(), True),
+            (ConnectionResetError(), True),
+            (ValueError(), False),
+        ]
+        for error, temporary in cases:
+            with self.subTest(error=repr(error)):
+                self.assertIs(is_temporary(error), temporary)
+
+
+class CacheVersionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_evicted_counter_does_not_reuse_versions(self):
+        with mock.patch("mailing_management.caching.time.time", return_value=1000.0):
+            old = [get_version("test"), bump_version("test"), bump_version("test")]
+        # Счетчик вытеснен из кеша: новые версии не должны совпасть со старыми ключами
+        cache.delete("version:test")
+        with mock.patch("mailing_management.caching.time.time", return_value=1001.0):
+            self.assertNotIn(get_version("test"), old)
+            self.assertNotIn(bump_version("test"), old)
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_incr_keeps_other_l1_entries(self):
+        cache.set("page", "cached")
+        cache.set("counter", 1)
+        cache.incr("counter")
+        hits = cache.stats()["l1_hits"]
+        self.assertEqual(cache.get("page"), "cached")
+        self.assertEqual(cache.stats()["l1_hits"], hits + 1)
+
+    def test_version_counters_bypass_l1(self):
+        version = get_version("bypass")
+        # Другой воркер меняет счетчик прямо в общем кеше - новая версия видна сразу
+        caches["shared"].incr("version:bypass")
+        self.assertEqual(get_version("bypass"), version + 1)
+
+    def test_shared_file_cache_evicts_oldest_entries_but_keeps_versions(self):
+        with tempfile.TemporaryDirectory() as location:
+            shared = SharedFileCache(
+                location, {"TIMEOUT": None, "OPTIONS": {"MAX_ENTRIES": 4, "CULL_FREQUENCY": 2}}
+            )
+            for i in range(5):
+                shared.set(f"version:{i}", i)
+            for i in range(10):
+                shared.set(f"page:{i}", i)
+                # Порядок записи задается явно, чтобы не зависеть от точности mtime
+                os.utime(shared._key_to_file(f"page:{i}"), (i, i))
+            self.assertEqual([shared.get(f"version:{i}") for i in range(5)], list(range(5)))
+            self.assertLessEqual(len(shared._list_cache_files()), 4)
+            self.assertIsNone(shared.get("page:0"))
+            self.assertEqual(shared.get("page:9"), 9)
+            shared.clear()
+            self.assertIsNone(shared.get("version:0"))
+
+    def test_shared_rate_limit_requires_atomic_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SharedRateLimiter(5)
+
+
+class ClientListCacheTest(TestCase):
+    # Кешированные списки получателей: чужие страницы не видны, изменения сбрасывают кеш
+
+    def setUp(self):
+        cache.clear()
+        self.first_owner, self.second_owner = [
+            CustomUser.objects.create_user(
+                email=f"owner{i}@example.com", username=f"owner{i}", password="password", is_active=True
+            )
+            for i in range(2)
+        ]
+        self.manager = CustomUser.objects.create_user(
+            email="manager@example.com",
+            username="manager",
+            password="password",
+            is_active=True,
+            is_staff=True,
+        )
+        self.first_client = MailingClient.objects.create(
+            owner=self.first_owner, email="first@example.com", full_name="Первый"
+        )
+        self.second_client = MailingClient.objects.create(
+            owner=self.second_owner, email="second@example.com", full_name="Второй"
+        )
+
+    def emails(self, user):
+        return [client.email for client in get_client_page(user).object_list]
+
+    def warm(self):
+        # Заполняет кеш списками обоих владельцев и менеджера
+        return [self.emails(user) for user in (self.first_owner, self.second_owner, self.manager)]
+
+    def test_owner_does_not_see_other_owners_cached_page(self):
+        url = reverse("mailing_management:client_list")
+        for owner, email in (
+            (self.first_owner, "first@example.com"),
+            (self.second_owner, "second@example.com"),
+        ):
+            self.client.force_login(owner)
+            # Второй запрос отдается из кеша
+            for _ in range(2):
+                response = self.client.get(url)
+                self.assertEqual([client.email for client in response.context["clients"]], [email])
+
+    def test_edit_invalidates_owner_and_manager_lists(self):
+        self.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first_client.email = "renamed@example.com"
+            self.first_client.save()
+        self.assertEqual(self.emails(self.first_owner), ["renamed@example.com"])
+        self.assertEqual(self.emails(self.manager), ["renamed@example.com", "second@example.com"])
+
+    def test_owner_change_invalidates_both_owners(self):
+        self.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first_client.owner = self.second_owner
+            self.first_client.save()
+        self.assertEqual(self.emails(self.first_owner), [])
+        self.assertEqual(self.emails(self.second_owner), ["first@example.com", "second@example.com"])
+
+    def test_delete_invalidates_owner_and_manager_lists(self):
+        self.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first_client.delete()
+        self.assertEqual(self.emails(self.first_owner), [])
+        self.assertEqual(self.emails(self.manager), ["second@example.com"])
+
+
+class KeysetPaginationTest(TestCase):
+    # Обход всех страниц по курсору при повторяющихся значениях первого ключа сортировки
+
+    def setUp(self):
+        # Темы повторяются, порядок внутри одной темы задает только id
+        MessageManagement.objects.bulk_create(
+            [MessageManagement(subject=f"Тема {i % 3}", body="Текст") for i in range(23)]
+        )
+        self.expected = list(MessageManagement.objects.order_by("subject", "id").values_list("id", flat=True))
+
+    def test_walk_visits_every_row_once(self):
+        for size in (1, 4, 5, 23, 30):
+            with self.subTest(size=size):
+                ids, cursor = [], None
+                while True:
+                    page = keyset_page(MessageManagement.objects.all(), ("subject", "id"), cursor, size)
+                    ids += [message.id for message in page.object_list]
+                    cursor = page.next_cursor
+                    if cursor is None:
+                        break
+                self.assertEqual(ids, self.expected)
+
+    def test_view_walk_visits_every_row_once(self):
+        user = CustomUser.objects.create_superuser(
+            email="pages@example.com", username="pages", password="password", is_active=True
+        )
+        self.client.force_login(user)
+        url = reverse("mailing_management:message_list")
+        ids, params = [], {}
+        with mock.patch.object(MessageListView, "paginate_by", 7):
+            while True:
+                response = self.client.get(url, params)
+                ids += [message.id for message in response.context["messages"]]
+                if not response.context["next_cursor"]:
+                    break
+                params = {"cursor": response.context["next_cursor"]}
+        self.assertEqual(ids, self.expected)
+
+    def test_malformed_cursor_returns_400(self):
+        user = CustomUser.objects.create_superuser(
+            email="cursor@example.com", username="cursor", password="password", is_active=True
+        )
+        self.client.force_login(user)
+        url = reverse("mailing_management:message_list")
+        cursors = [
+            "не-курсор",
+            "%%%",
+            encode_cursor({"subject": "Тема 0"}),
+            encode_cursor(["Тема 0"]),
+            encode_cursor(["Тема 0", "не число"]),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url, {"cursor": cursor}).status_code, 400)
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Число SQL-запросов каждой страницы не должно зависеть от количества данных.
+
+    Страница открывается на маленьком и на в десять раз большем наборе данных;
+    в обоих случаях число запросов должно совпасть с бюджетом.
+    """
+
+    sizes = (3, 30)
+
+    # Имя URL, метод и бюджет запросов (сессия и пользователь входят в бюджет)
+    budgets = {
+        "mailing_management:home": ("get", 3),
+        "mailing_management:contacts": ("get", 2),
+        "mailing_management:client_list": ("get", 3),
+        "mailing_management:client_detail": ("get", 4),
+        "mailing_management:client_form": ("get", 4),
+        "mailing_management:client_update": ("get", 6),
+        "mailing_management:delete_client": ("get", 4),
+        "mailing_management:message_list": ("get", 3),
+        "mailing_management:message_detail": ("get", 3),
+        "mailing_management:message_create": ("get", 2),
+        "mailing_management:message_update": ("get", 3),
+        "mailing_management:message_delete": ("get", 3),
+        "mailing_management:newsletter_list": ("get", 4),
+        "mailing_management:newsletter_detail": ("get", 4),
+        "mailing_management:newsletter_create": ("get", 5),
+        "mailing_management:newsletter_update": ("get", 8),
+        "mailing_management:newsletter_delete": ("get", 5),
+        "mailing_management:newsletter_recipients": ("get", 4),
+        "mailing_management:newsletter_send": ("get", 14),
+        "mailing_management:statistics": ("get", 4),
+        "mailing_management:export": ("get", 3),
+        "mailing_management:send_mail_and_update_statistics": ("post", 2),
+        "users:home": ("get", 3),
+        "users:register": ("get", 2),
+        "users:login": ("get", 2),
+        "users:logout": ("post", 4),
+        "users:email_confirm": ("get", 1),
+        "users:password_reset": ("get", 2),
+        "users:password_reset_done": ("get", 2),
+        "users:password_reset_confirm": ("get", 3),
+        "users:password_reset_complete": ("get", 2),
+    }
+
+    # Списки и имя списка в контексте: размер страницы в расчете на строку тоже не
+    # должен расти с данными, иначе строка тянет за собой все связанные записи
+    list_pages = {
+        "mailing_management:client_list": "clients",
+        "mailing_management:message_list": "messages",
+        "mailing_management:newsletter_list": "newsletters",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_superuser(
+            email="owner@example.com", username="owner", password="password", is_active=True
+        )
+
+    def seed(self, count):
+        # Добавляет count клиентов и рассылок; каждая рассылка - на всех клиентов
+        start = MailingClient.objects.count()
+        clients = MailingClient.objects.bulk_create(
+            [
+                MailingClient(
+                    owner=self.user,
+                    email=f"client{i}@example.com",
+                    full_name=f"Клиент {i}",
+                    comment="Комментарий",
+                )
+                for i in range(start, start + count)
+            ]
+        )
+        all_clients = list(MailingClient.objects.all())
+        for i in range(count):
+            message = MessageManagement.objects.create(subject=f"Тема {start + i}", body="Текст")
+            newsletter = Newsletter.objects.create(owner=self.user, message=message)
+            newsletter.clients.set(all_clients)
+            NewsletterAttempt.objects.bulk_create(
+                [
+                    NewsletterAttempt(newsletter=newsletter, client=client, status="successful")
+                    for client in clients
+                ]
+            )
+            NewsletterStatistics.increment(newsletter.id, successful=len(clients))
+
+    def get_url(self, name):
+        if name in self.list_pages:
+            # Списки открываются и без данных
+            return reverse(name)
+        client = MailingClient.objects.first()
+        message = MessageManagement.objects.first()
+        newsletter = Newsletter.objects.first()
+        kwargs = {
+            "mailing_management:client_detail": {"pk": client.pk},
+            "mailing_management:client_update": {"pk": client.pk},
+            "mailing_management:delete_client": {"pk": client.pk},
+            "mailing_management:message_detail": {"pk": message.pk},
+            "mailing_management:message_update": {"pk": message.pk},
+            "mailing_management:message_delete": {"pk": message.pk},
+            "mailing_management:newsletter_detail": {"pk": newsletter.pk},
+            "mailing_management:newsletter_update": {"pk": newsletter.pk},
+            "mailing_management:newsletter_delete": {"pk": newsletter.pk},
+            "mailing_management:newsletter_recipients": {"pk": newsletter.pk},
+            # Отправляется только что созданная рассылка, чтобы очередь всегда была пустой
+            "mailing_management:newsletter_send": {"pk": Newsletter.objects.latest("id").pk},
+            "mailing_management:export": {"name": "attempts"},
+            "users:email_confirm": {"token": "unknown"},
+            "users:password_reset_confirm": {"uidb64": "MQ", "token": "set-password"},
+        }.get(name, {})
+        return reverse(name, kwargs=kwargs)
+
+    def request(self, name, method):
+        # Возвращает ответ и число выполненных запросов
+        url = self.get_url(name)
+        self.client.force_login(self.user)
+        # Кешированные страницы скрыли бы запросы, поэтому кеш очищается перед замером
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        return response, len(queries)
+
+    def count_queries(self, name, method):
+        return self.request(name, method)[1]
+
+    def test_query_budget_does_not_grow_with_data(self):
+        counts = {}
+        for size in self.sizes:
+            self.seed(size)
+            for name, (method, budget) in self.budgets.items():
+                counts.setdefault(name, []).append(self.count_queries(name, method))
+
+        for name, (method, budget) in self.budgets.items():
+            with self.subTest(url=name):
+                self.assertEqual(counts[name], [budget] * len(self.sizes))
+
+    def test_list_row_size_does_not_grow_with_data(self):
+        # Пустой список - только оформление страницы, остальное приходится на строки
+        empty = {name: len(self.request(name, "get")[0].content) for name in self.list_pages}
+        row_sizes = {}
+        for size in self.sizes:
+            self.seed(size)
+            for name, context_name in self.list_pages.items():
+                response, queries = self.request(name, "get")
+                rows = len(response.context[context_name])
+                row_sizes.setdefault(name, []).append((len(response.content) - empty[name]) / rows)
+
+        for name, (small, large) in row_sizes.items():
+            with self.subTest(url=name):
+                self.assertLess(large, small * 1.1)
+
+
+class DeliveryQueueTest(TestCase):
+    # Очередь писем: постановка, выдача воркерам, зависшие задания и повторы
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(
+            email="queue@example.com", username="queue", password="password", is_active=True
+        )
+        message = MessageManagement.objects.create(subject="Тема", body="Текст")
+        self.newsletter = Newsletter.objects.create(owner=self.owner, message=message)
+        self.clients = MailingClient.objects.bulk_create(
+            [
+                MailingClient(owner=self.owner, email=f"queue{i}@example.com", full_name=f"Клиент {i}")
+                for i in range(3)
+            ]
+        )
+        self.newsletter.clients.set(self.clients)
+
+    def test_enqueue_creates_one_job_per_recipient(self):
+        self.assertEqual(enqueue_newsletter(self.newsletter), 3)
+        # Повторная постановка не создает дубликатов
+        self.assertEqual(enqueue_newsletter(self.newsletter), 3)
+        self.assertEqual(NewsletterDelivery.objects.filter(newsletter=self.newsletter).count(), 3)
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        enqueue_newsletter(self.newsletter)
+        first = claim_deliveries(2)
+        second = claim_deliveries(10)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({delivery.id for delivery in first} & {delivery.id for delivery in second})
+        self.assertEqual(claim_deliveries(10), [])
+        self.assertEqual(NewsletterDelivery.objects.filter(status="processing").count(), 3)
+
+    def test_stale_lease_is_released(self):
+        enqueue_newsletter(self.newsletter)
+        stale, *fresh = claim_deliveries(10)
+        with self.settings(MAIL_WORKER_LEASE=60):
+            NewsletterDelivery.objects.filter(pk=stale.pk).update(
+                locked_at=stale.locked_at - timedelta(seconds=61)
+            )
+            self.assertEqual(release_stale_deliveries(), 1)
+        # Задание упавшего воркера снова выдается, остальные остаются за своими воркерами
+        self.assertEqual([delivery.pk for delivery in claim_deliveries(10)], [stale.pk])
+
+    @override_settings(NEWSLETTER_MAX_RETRIES=2)
+    def test_temporary_failure_is_retried_then_failed(self):
+        enqueue_newsletter(self.newsletter)
+        client_id = self.clients[0].id
+        delivery = NewsletterDelivery.objects.get(newsletter=self.newsletter, client_id=client_id)
+        error = SendError("451 Try again later", True)
+
+        with AttemptBuffer(self.newsletter) as attempts:
+            attempts.add(client_id, error)
+        delivery.refresh_from_db()
+        # Первый временный отказ - повтор по расписанию, неудачей он не считается
+        self.assertEqual((delivery.status, delivery.attempts), ("pending", 1))
+        self.assertGreater(delivery.available_at, timezone.now())
+        self.assertFalse(NewsletterAttempt.objects.filter(newsletter=self.newsletter).exists())
+
+        with AttemptBuffer(self.newsletter) as attempts:
+            attempts.add(client_id, error)
+        delivery.refresh_from_db()
+        # Повторы кончились - задание окончательно неудачное и попадает в статистику
+        self.assertEqual((delivery.status, delivery.attempts), ("failed", 2))
+        self.assertEqual(delivery.last_error, error.message)
+        self.assertEqual(
+            list(
+                NewsletterAttempt.objects.filter(newsletter=self.newsletter).values_list("status", flat=True)
+            ),
+            ["failed"],
+        )
+        statistics = NewsletterStatistics.objects.get(newsletter=self.newsletter)
+        self.assertEqual(
+            (statistics.total_sent, statistics.successful_attempts, statistics.failed_attempts), (1, 0, 1)
+        )
+
+    def test_worker_sends_whole_queue(self):
+        enqueue_newsletter(self.newsletter)
+        call_command("run_mail_worker", "--once", stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(NewsletterDelivery.objects.filter(status="sent").count(), 3)
+        self.assertEqual(NewsletterStatistics.objects.get(newsletter=self.newsletter).successful_attempts, 3)
+
+
+class SchedulerTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        message = MessageManagement.objects.create(subject="Тема", body="Текст")
+        self.newsletter = Newsletter.objects.create(
+            message=message, beginning_date=self.now + timedelta(hours=1)
+        )
+        self.newsletter.clients.set(
+            MailingClient.objects.bulk_create(
+                [MailingClient(email=f"scheduled{i}@example.com", full_name=f"Клиент {i}") for i in range(2)]
+            )
+        )
+
+    def status(self):
+        self.newsletter.refresh_from_db()
+        return self.newsletter.status
+
+    def test_newsletter_waits_for_beginning_date(self):
+        self.assertEqual(run_scheduler_tick(self.now), self.newsletter.beginning_date)
+        self.assertEqual(self.status(), "created")
+        self.assertFalse(self.newsletter.deliveries.exists())
+
+    def test_draft_without_beginning_date_is_not_started(self):
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(beginning_date=None)
+        self.assertIsNone(run_scheduler_tick(self.now + timedelta(days=365)))
+        self.assertEqual(self.status(), "created")
+
+    def test_due_newsletter_is_started_and_enqueued(self):
+        run_scheduler_tick(self.now + timedelta(hours=2))
+        self.assertEqual(self.status(), "started")
+        self.assertEqual(self.newsletter.deliveries.filter(status="pending").count(), 2)
+
+    def test_start_is_rolled_back_if_enqueue_fails(self):
+        with mock.patch("mailing_management.services.enqueue_newsletter", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                run_scheduler_tick(self.now + timedelta(hours=2))
+        # Рассылка не осталась запущенной без заданий - следующий проход запустит ее снова
+        self.assertEqual(self.status(), "created")
+        run_scheduler_tick(self.now + timedelta(hours=2))
+        self.assertEqual(self.newsletter.deliveries.filter(status="pending").count(), 2)
+
+    def test_expired_newsletter_is_finished(self):
+        run_scheduler_tick(self.now + timedelta(hours=2))
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(end_date=self.now + timedelta(hours=3))
+        run_scheduler_tick(self.now + timedelta(hours=4))
+        self.assertEqual(self.status(), "finished")
+        self.assertEqual(
+            list(self.newsletter.deliveries.values_list("status", "last_error").distinct()),
+            [("failed", "Срок рассылки истек")],
+        )
+
+    def test_drained_newsletter_is_finished(self):
+        run_scheduler_tick(self.now + timedelta(hours=2))
+        self.newsletter.deliveries.update(status="sent")
+        run_scheduler_tick(self.now + timedelta(hours=2))
+        self.assertEqual(self.status(), "finished")
+
+
+class NewsletterStatusEditTest(TestCase):
+    # Запустить рассылку правкой статуса в обход очереди нельзя
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(
+            email="status@example.com", username="status", password="password", is_active=True
+        )
+        message = MessageManagement.objects.create(subject="Тема", body="Текст")
+        self.newsletter = Newsletter.objects.create(owner=self.owner, message=message)
+        self.newsletter.clients.set(
+            MailingClient.objects.bulk_create(
+                [
+                    MailingClient(owner=self.owner, email=f"status{i}@example.com", full_name=f"Клиент {i}")
+                    for i in range(2)
+                ]
+            )
+        )
+        self.url = reverse("mailing_management:newsletter_update", kwargs={"pk": self.newsletter.pk})
+
+    def create_moderator(self):
+        moderator = CustomUser.objects.create_user(
+            email="moderator@example.com", username="moderator", password="password", is_active=True
+        )
+        moderator.user_permissions.add(Permission.objects.get(codename="can_unpublish_newsletter"))
+        return moderator
+
+    def test_owner_cannot_change_status(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url)
+        self.assertNotIn("status", response.context["form"].fields)
+
+    def test_moderator_start_enqueues_recipients(self):
+        moderator = self.create_moderator()
+        self.client.force_login(moderator)
+        response = self.client.post(self.url, {"status": "started"})
+        self.assertEqual(response.status_code, 302)
+        self.newsletter.refresh_from_db()
+        self.assertEqual(self.newsletter.status, "started")
+        self.assertEqual(self.newsletter.deliveries.filter(status="pending").count(), 2)
+
+    def test_moderator_finish_cancels_queue(self):
+        moderator = self.create_moderator()
+        enqueue_newsletter(self.newsletter)
+        self.client.force_login(moderator)
+        response = self.client.post(self.url, {"status": "finished"})
+        self.assertEqual(response.status_code, 302)
+        self.newsletter.refresh_from_db()
+        self.assertEqual(self.newsletter.status, "finished")
+        self.assertFalse(self.newsletter.deliveries.filter(status="pending").exists())
+        self.assertEqual(claim_deliveries(10), [])
+
+    def test_jobs_of_stopped_newsletter_are_not_claimed(self):
+        enqueue_newsletter(self.newsletter)
+        # Статус сменили в обход очереди - задания остались, но отправлять их нельзя
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(status="finished")
+        self.assertEqual(claim_deliveries(10), [])
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+class DeliveryQueueLockingTest(TransactionTestCase):
+    # Задания, заблокированные другим воркером, пропускаются, а не ждут освобождения
+
+    def test_locked_jobs_are_skipped(self):
+        message = MessageManagement.objects.create(subject="Тема", body="Текст")
+        newsletter = Newsletter.objects.create(message=message)
+        newsletter.clients.set(
+            MailingClient.objects.bulk_create(
+                [MailingClient(email=f"lock{i}@example.com", full_name=f"Клиент {i}") for i in range(2)]
+            )
+        )
+        enqueue_newsletter(newsletter)
+        locked = NewsletterDelivery.objects.order_by("id").first()
+        claimed = []
+
+        def worker():
+            try:
+                claimed.extend(claim_deliveries(10))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            NewsletterDelivery.objects.select_for_update().get(pk=locked.pk)
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(claimed), 1)
+        self.assertNotEqual(claimed[0].pk, locked.pk)
@@ -0,0 +1,172 @@
+import abc
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+
+
+class RateLimiter(abc.ABC):
+    """
+    Ограничение скорости отправки с адаптивным снижением.
+
+    На временный отказ сервера (4xx) скорость уменьшается вдвое, после каждого
+    успешного письма понемногу возвращается к настроенной.
+    """
+
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.min_rate = rate * settings.NEWSLETTER_RATE_MIN_FACTOR
+        self.rate = rate
+        self.lock = threading.Lock()
+
+    @abc.abstractmethod
+    def acquire(self):
+        """Ждет, пока можно отправить следующее письмо."""
+
+    def penalize(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class TokenBucket(RateLimiter):
+    # Ограничение в пределах одного процесса, общее для всех его потоков
+
+    def __init__(self, rate, burst=None):
+        super().__init__(rate)
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Ограничение, общее для всех воркеров: счетчик писем за текущую секунду
+    хранится в кеше "shared". Счетчик должен увеличиваться атомарно, поэтому
+    нужен Redis или memcached; с файловым кешем параллельные incr теряются
+    и лимит превышается в разы.
+    """
+
+    key_prefix = "smtp-rate"
+    atomic_backends = (RedisCache, BaseMemcachedCache)
+
+    def __init__(self, rate):
+        if not isinstance(caches["shared"], self.atomic_backends):
+            raise ImproperlyConfigured(
+                "NEWSLETTER_RATE_SHARED требует общий кеш с атомарным incr: задайте REDIS_URL"
+            )
+        super().__init__(rate)
+
+    def acquire(self):
+        # Счетчик живет только в общем кеше: копия в L1 воркера была бы устаревшей
+        cache = caches["shared"]
+        while True:
+            window = int(time.time())
+            key = f"{self.key_prefix}:{window}"
+            cache.add(key, 0, timeout=5)
+            try:
+                count = cache.incr(key)
+            except ValueError:
+                # Ключ успел истечь между add и incr
+                continue
+            if count <= max(1, int(self.rate)):
+                return
+            time.sleep(max(0.0, window + 1 - time.time()))
+
+
+class AdaptiveBackoff:
+    """
+    Замедление без настроенного лимита скорости.
+
+    Пока сервер не жалуется, письма идут без пауз. Временный отказ (4xx)
+    вводит паузу между письмами всех потоков, каждый следующий удваивает ее
+    (до NEWSLETTER_BACKOFF_MAX_DELAY); успешные письма понемногу сокращают
+    паузу, пока она не исчезнет совсем.
+    """
+
+    def __init__(self, delay=None, max_delay=None):
+        self.initial_delay = delay or settings.NEWSLETTER_BACKOFF_DELAY
+        self.max_delay = max_delay or settings.NEWSLETTER_BACKOFF_MAX_DELAY
+        self.delay = 0.0
+        self.next_send = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if not self.delay:
+                return
+            now = time.monotonic()
+            wait = max(0.0, self.next_send - now)
+            self.next_send = max(now, self.next_send) + self.delay
+        if wait:
+            time.sleep(wait)
+
+    def penalize(self):
+        with self.lock:
+            self.delay = min(self.max_delay, max(self.initial_delay, self.delay * 2))
+
+    def reward(self):
+        with self.lock:
+            self.delay *= 0.95
+            if self.delay < self.initial_delay / 10:
+                self.delay = 0.0
+
+
+class NoRateLimit:
+    def acquire(self):
+        pass
+
+    def penalize(self):
+        pass
+
+    def reward(self):
+        pass
+
+
+def get_rate_limiter():
+    rate = settings.NEWSLETTER_RATE_LIMIT
+    if not rate:
+        # Лимита нет, но на отказы сервера все равно притормаживаем
+        return AdaptiveBackoff()
+    if settings.NEWSLETTER_RATE_SHARED:
+        return SharedRateLimiter(rate)
+    return TokenBucket(rate, settings.NEWSLETTER_RATE_BURST)
+
+
+def is_temporary(error):
+    # 4xx-ответы и обрывы соединения считаются временными, их стоит повторить
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, message in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    # Сетевые ошибки: таймауты, сброс соединения
+    return isinstance(error, OSError)
+
+
+def retry_delay(attempts):
+    # Экспоненциальная пауза перед повтором: 1, 2, 4, ... базовых интервала
+    return settings.NEWSLETTER_RETRY_DELAY * 2 ** attempts
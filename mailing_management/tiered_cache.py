@@ -0,0 +1,241 @@
+import glob
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+# L1 и счетчики общие для всех потоков процесса, по одному набору на LOCATION
+# (кеш-бэкенды Django создаются в каждом потоке заново)
+_l1_caches = {}
+_l1_locks = {}
+_l1_states = {}
+
+EPOCH_KEY = "tiered-cache:epoch"
+
+
+class TieredCache(BaseCache):
+    """
+    Двухуровневый кеш: L1 - небольшой LRU в памяти процесса, L2 - общий
+    для всех воркеров кеш из CACHES (OPTIONS["L2"]).
+
+    Чтение идет сначала в L1, при промахе - в L2 с сохранением в L1 не дольше
+    L1_TIMEOUT секунд. delete и clear меняют эпоху в L2; воркер сверяет эпоху
+    не чаще раза в EPOCH_INTERVAL секунд и при смене очищает свой L1, так что
+    инвалидация доходит до всех процессов. Перезапись ключа через set() и
+    incr/decr видны другим воркерам не позже чем через L1_TIMEOUT, поэтому
+    изменяемые данные лучше хранить под версионными ключами (caching.versioned_key).
+
+    Ключи с префиксами из L1_BYPASS (по умолчанию счетчики версий "version:")
+    в L1 не попадают: их читают и меняют сразу в L2, и новая версия видна всем
+    воркерам без сброса их L1.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._l2_alias = options.get("L2", "shared")
+        self._l1_max_entries = int(options.get("L1_MAX_ENTRIES", 1000))
+        self._l1_timeout = float(options.get("L1_TIMEOUT", 5))
+        self._epoch_interval = float(options.get("EPOCH_INTERVAL", 1))
+        self._l1_bypass = tuple(options.get("L1_BYPASS", ("version:",)))
+        self._l1 = _l1_caches.setdefault(location, OrderedDict())
+        self._lock = _l1_locks.setdefault(location, threading.Lock())
+        self._state = _l1_states.setdefault(
+            location, {"epoch": None, "checked": 0.0, "l1_hits": 0, "l2_hits": 0, "misses": 0}
+        )
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _l1_key(self, key, version):
+        # None - ключ хранится только в L2
+        if key.startswith(self._l1_bypass):
+            return None
+        return self.l2.make_and_validate_key(key, version=version)
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _check_epoch(self):
+        now = time.monotonic()
+        if now - self._state["checked"] < self._epoch_interval:
+            return
+        epoch = self.l2.get(EPOCH_KEY)
+        with self._lock:
+            self._state["checked"] = now
+            if epoch != self._state["epoch"]:
+                self._l1.clear()
+                self._state["epoch"] = epoch
+
+    def _bump_epoch(self):
+        # Эпоха - случайная метка, а не счетчик: после clear() в L2 она не повторится
+        epoch = uuid.uuid4().hex
+        self.l2.set(EPOCH_KEY, epoch, None)
+        with self._lock:
+            self._l1.clear()
+            self._state["epoch"] = epoch
+            self._state["checked"] = time.monotonic()
+
+    def _count(self, name):
+        with self._lock:
+            self._state[name] += 1
+
+    def _l1_set(self, l1_key, value, timeout):
+        if l1_key is None or timeout is not None and timeout <= 0:
+            return
+        ttl = self._l1_timeout if timeout is None else min(timeout, self._l1_timeout)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._l1[l1_key] = (time.monotonic() + ttl, data)
+            self._l1.move_to_end(l1_key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_get(self, l1_key):
+        if l1_key is None:
+            return False, None
+        with self._lock:
+            entry = self._l1.get(l1_key)
+            if entry is None:
+                return False, None
+            expires, data = entry
+            if expires <= time.monotonic():
+                del self._l1[l1_key]
+                return False, None
+            self._l1.move_to_end(l1_key)
+        return True, pickle.loads(data)
+
+    def get(self, key, default=None, version=None):
+        self._check_epoch()
+        l1_key = self._l1_key(key, version)
+        found, value = self._l1_get(l1_key)
+        if found:
+            self._count("l1_hits")
+            return value
+        missing = object()
+        value = self.l2.get(key, missing, version=version)
+        if value is missing:
+            self._count("misses")
+            return default
+        self._count("l2_hits")
+        self._l1_set(l1_key, value, None)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        self.l2.set(key, value, timeout, version=version)
+        self._l1_set(self._l1_key(key, version), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._l1_set(self._l1_key(key, version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, self._timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        deleted = self.l2.delete(key, version=version)
+        self._bump_epoch()
+        return deleted
+
+    def _l1_delete(self, key, version):
+        l1_key = self._l1_key(key, version)
+        with self._lock:
+            self._l1.pop(l1_key, None)
+
+    def incr(self, key, delta=1, version=None):
+        # Эпоха не меняется: частые счетчики иначе сбрасывали бы L1 всех воркеров
+        value = self.l2.incr(key, delta, version=version)
+        self._l1_delete(key, version)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        value = self.l2.decr(key, delta, version=version)
+        self._l1_delete(key, version)
+        return value
+
+    def has_key(self, key, version=None):
+        self._check_epoch()
+        found, _ = self._l1_get(self._l1_key(key, version))
+        return found or self.l2.has_key(key, version=version)
+
+    def clear(self):
+        self.l2.clear()
+        self._bump_epoch()
+
+    def stats(self):
+        # Попадания и промахи с запуска процесса
+        with self._lock:
+            state = dict(self._state)
+            entries = len(self._l1)
+        total = state["l1_hits"] + state["l2_hits"] + state["misses"]
+        return {
+            "l1_hits": state["l1_hits"],
+            "l2_hits": state["l2_hits"],
+            "misses": state["misses"],
+            "l1_entries": entries,
+            "l1_hit_rate": state["l1_hits"] / total if total else 0.0,
+            "hit_rate": (state["l1_hits"] + state["l2_hits"]) / total if total else 0.0,
+        }
+
+
+class SharedFileCache(FileBasedCache):
+    """
+    Файловый кеш для общего уровня, когда Redis не настроен.
+
+    Ключи с префиксами из PINNED (по умолчанию счетчики версий "version:")
+    лежат в отдельном подкаталоге и при переполнении не вытесняются. Из остальных
+    при MAX_ENTRIES удаляется доля 1/CULL_FREQUENCY самых давно записанных,
+    так что после вытеснения в кеше снова есть запас и следующие set() не
+    перебирают весь каталог.
+
+    incr у файлового кеша не атомарен (чтение и запись), поэтому для общих
+    счетчиков между процессами, например NEWSLETTER_RATE_SHARED, он не годится.
+    """
+
+    pinned_dir = "pinned"
+
+    def __init__(self, location, params):
+        self._pinned = tuple(params.get("OPTIONS", {}).get("PINNED", ("version:",)))
+        super().__init__(location, params)
+
+    def _key_to_file(self, key, version=None):
+        fname = super()._key_to_file(key, version)
+        if key.startswith(self._pinned):
+            return os.path.join(self._dir, self.pinned_dir, os.path.basename(fname))
+        return fname
+
+    def _createdir(self):
+        super()._createdir()
+        os.makedirs(os.path.join(self._dir, self.pinned_dir), 0o700, exist_ok=True)
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        # Время записи - по mtime файла; CULL_FREQUENCY=0 освобождает все незакрепленные
+        entries = []
+        for fname in filelist:
+            try:
+                entries.append((os.path.getmtime(fname), fname))
+            except FileNotFoundError:
+                pass
+        entries.sort()
+        for mtime, fname in entries[: max(1, len(entries) // (self._cull_frequency or 1))]:
+            self._delete(fname)
+
+    def clear(self):
+        super().clear()
+        pinned = os.path.join(self._dir, self.pinned_dir)
+        for fname in glob.glob(f"*{self.cache_suffix}", root_dir=pinned):
+            self._delete(os.path.join(pinned, fname))
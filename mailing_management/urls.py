@@ -15,9 +15,13 @@ from mailing_management.views import (
     MessageDeleteView,
     NewsletterListView,
     NewsletterDetailView,
+    NewsletterRecipientsView,
     NewsletterCreateView,
     NewsletterUpdateView,
     NewsletterDeleteView, SendMailAndUpdateStatisticsView,
+    SendNewsletterView,
+    StatisticsView,
+    ExportView,
 )
 from mailing_management.views import ClientListView
 
@@ -65,5 +69,17 @@ urlpatterns = [
         NewsletterDeleteView.as_view(),
         name="newsletter_delete",
     ),
+    path(
+        "newsletters/<int:pk>/recipients/",
+        NewsletterRecipientsView.as_view(),
+        name="newsletter_recipients",
+    ),
+    path(
+        "newsletters/<int:pk>/send/",
+        SendNewsletterView.as_view(),
+        name="newsletter_send",
+    ),
+    path("statistics/", StatisticsView.as_view(), name="statistics"),
+    path("export/<str:name>/", ExportView.as_view(), name="export"),
     path('send-mail/', SendMailAndUpdateStatisticsView.as_view(), name='send_mail_and_update_statistics'),
 ]
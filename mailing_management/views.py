@@ -6,12 +6,12 @@ from django.contrib.auth.mixins import (
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
-from django.http import HttpResponseForbidden
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
-from django.utils.decorators import method_decorator
 from django.views import View
-from django.views.decorators.cache import cache_page
 from django.views.generic import (
     DeleteView,
     ListView,
@@ -22,6 +22,7 @@ from django.views.generic import (
 )
 
 from config import settings
+from mailing_management.exports import EXPORTS, csv_chunks, gzip_chunks
 from mailing_management.forms import (
     MailingClientForm,
     MailingClientModeratorForm,
@@ -29,17 +30,35 @@ from mailing_management.forms import (
     NewsletterModeratorForm,
 )
 from mailing_management.forms import NewsletterForm
-from mailing_management.models import MailingClient, MessageManagement, Newsletter, NewsletterStatistics
+from mailing_management.models import MailingClient, MessageManagement, Newsletter, SiteCounter
+from mailing_management.pagination import KeysetPaginationMixin
 from mailing_management.services import (
+    CLIENT_KEYSET,
     ClientService,
     MessageService,
-    NewsletterService,
-    send_newsletter,
+    enqueue_newsletter,
+    finish_newsletters,
+    get_client_page,
+    get_owner_statistics,
+    get_recipient_count,
+    get_recipient_page,
+    visible_clients,
 )
 
 
+class SingleObjectCacheMixin:
+    # get_object() вызывается в test_func, get_form_class и в самом представлении -
+    # объект загружаем один раз за запрос
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, "_cached_object"):
+            self._cached_object = super().get_object()
+        return self._cached_object
+
+
 # Create your views here.
-class ClientDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class ClientDeleteView(SingleObjectCacheMixin, LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     model = MailingClient
     template_name = "mailing_management/client_confirm_delete.html"
     success_url = reverse_lazy("mailing_management:home")
@@ -72,7 +91,7 @@ class ClientCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class ClientUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class ClientUpdateView(SingleObjectCacheMixin, LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     model = MailingClient
     form_class = MailingClientForm
     template_name = "mailing_management/client_form.html"
@@ -108,20 +127,19 @@ class ClientUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return super().form_valid(form)
 
 
-class ClientListView(LoginRequiredMixin, ListView):
+class ClientListView(KeysetPaginationMixin, LoginRequiredMixin, ListView):
     model = MailingClient
     template_name = "mailing_management/client_list.html"
     context_object_name = "clients"
-
-    @method_decorator(cache_page(60 * 15))  # Кешируем страницу на 15 минут
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+    keyset_fields = CLIENT_KEYSET
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        if self.request.user.is_staff:
-            return queryset  # Менеджеры могут видеть все
-        return queryset.filter(owner=self.request.user)  # Пользователи видят только свои
+        return visible_clients(self.request.user)
+
+    def get_keyset_page(self, queryset, cursor):
+        # Страницы кешируются отдельно для каждого пользователя и сбрасываются
+        # сигналами при изменении получателей
+        return get_client_page(self.request.user, cursor)
 
 
 class ClientDetailView(DetailView):
@@ -192,10 +210,11 @@ class MessageUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return super().form_valid(form)
 
 
-class MessageListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class MessageListView(KeysetPaginationMixin, LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = MessageManagement
     template_name = "mailing_management/message_list.html"
     context_object_name = "messages"
+    keyset_fields = ("subject", "id")
 
     def test_func(self):
         # Проверяем, имеет ли пользователь право на просмотр всех сообщений
@@ -229,20 +248,42 @@ class MessageDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         return context
 
 
-class NewsletterListView(LoginRequiredMixin, ListView):
+class NewsletterListView(KeysetPaginationMixin, LoginRequiredMixin, ListView):
     model = Newsletter
     template_name = "mailing_management/newsletter_list.html"
     context_object_name = "newsletters"
+    # ordering = ["message"] сортирует через join по теме письма; для курсора берем
+    # сам внешний ключ - его покрывает индекс (owner, message, id)
+    keyset_fields = ("message_id", "id")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["can_delete"] = self.request.user.has_perm(
             "mailing_management.delete_newsletter"
         )
+        preview = settings.NEWSLETTER_CLIENTS_PREVIEW
+        for newsletter in context["newsletters"]:
+            # Лишний загруженный получатель значит, что показаны не все
+            newsletter.more_clients = len(newsletter.preview_clients) > preview
+            newsletter.preview_clients = newsletter.preview_clients[:preview]
         return context
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # Письмо и первые получатели загружаются для всей страницы сразу, а не для каждой
+        # рассылки; всех получателей не берем - их у рассылки могут быть тысячи
+        preview = MailingClient.objects.only("id", "email").order_by("email")
+        queryset = (
+            super()
+            .get_queryset()
+            .select_related("message")
+            .prefetch_related(
+                Prefetch(
+                    "clients",
+                    queryset=preview[: settings.NEWSLETTER_CLIENTS_PREVIEW + 1],
+                    to_attr="preview_clients",
+                )
+            )
+        )
 
         # Проверка прав доступа
         if not (
@@ -261,15 +302,35 @@ class NewsletterDetailView(DetailView):
     )
     context_object_name = "newsletter"
 
+    def get_queryset(self):
+        return super().get_queryset().select_related("message")
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        newsletter_id = self.object.id
-        context["newsletter_list"] = NewsletterService.get_newsletter_list(
-            newsletter_id
-        )
+        # Сами получатели подгружаются страницами через NewsletterRecipientsView
+        context["recipient_count"] = get_recipient_count(self.object)
         return context
 
 
+class NewsletterRecipientsView(LoginRequiredMixin, View):
+    # Страница получателей рассылки в JSON для таблицы на странице рассылки
+    def get(self, request, pk, *args, **kwargs):
+        newsletters = Newsletter.objects.all()
+        if not (request.user.is_staff or request.user.has_perm("mailing_management.view_all_newsletters")):
+            newsletters = newsletters.filter(owner=request.user)
+        newsletter = get_object_or_404(newsletters, pk=pk)
+        page = get_recipient_page(newsletter, request.GET.get("cursor"))
+        return JsonResponse(
+            {
+                "results": [
+                    {"id": client.id, "email": client.email, "full_name": client.full_name}
+                    for client in page.object_list
+                ],
+                "next": page.next_cursor,
+            }
+        )
+
+
 class NewsletterCreateView(LoginRequiredMixin, CreateView):
     model = Newsletter
     form_class = NewsletterForm
@@ -281,7 +342,7 @@ class NewsletterCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class NewsletterUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class NewsletterUpdateView(SingleObjectCacheMixin, LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     model = Newsletter
     template_name = "mailing_management/newsletter_form.html"
 
@@ -310,15 +371,24 @@ class NewsletterUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         )
 
     def form_valid(self, form):
-        # Проверяем, является ли пользователь модератором
-        if self.request.user.has_perm("mailing_management.can_unpublish_newsletter"):
+        # Статус в форме есть только у модератора, и меняется он через очередь:
+        # запуск ставит задания (без них планировщик сразу завершил бы рассылку),
+        # завершение снимает неотправленные, чтобы воркер их больше не брал
+        newsletter = form.instance
+        status = newsletter.status
+        if status == newsletter.loaded_status or status not in ("started", "finished"):
             return super().form_valid(form)
-        # Если пользователь не модератор, удаляем поле 'status' из данных формы
-        form.cleaned_data.pop("status", None)
-        return super().form_valid(form)
+        newsletter.status = newsletter.loaded_status
+        with transaction.atomic():
+            response = super().form_valid(form)
+            if status == "started":
+                enqueue_newsletter(newsletter, resume=True)
+            else:
+                finish_newsletters(Newsletter.objects.filter(pk=newsletter.pk), "Рассылка остановлена модератором")
+        return response
 
 
-class NewsletterDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class NewsletterDeleteView(SingleObjectCacheMixin, LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     model = Newsletter
     template_name = "mailing_management/newsletter_confirm_delete.html"
     success_url = reverse_lazy("mailing_management:newsletter_list")
@@ -346,25 +416,25 @@ class SendNewsletterView(LoginRequiredMixin, PermissionRequiredMixin, View):
         newsletter_id = kwargs.get("pk")
         newsletter = get_object_or_404(Newsletter, id=newsletter_id)
 
-        # Отправляем рассылку
-        send_newsletter(newsletter)
+        # Ставим рассылку в очередь, письма отправит run_mail_worker.
+        # ?resume=1 - только тем, кому рассылка еще не доставлена
+        enqueue_newsletter(newsletter, resume=request.GET.get("resume") == "1")
 
         return redirect("mailing_management:newsletter_detail", pk=newsletter_id)
 
 
-class HomeView(ListView):
-    model = MailingClient  # Используем Client как основную модель для ListView
+class HomeView(TemplateView):
     template_name = "mailing_management/home.html"
-    context_object_name = "clients"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["total_newsletters"] = Newsletter.objects.count()
-        context["active_newsletters"] = Newsletter.objects.filter(
-            status="Запущена"
-        ).count()
-        context["unique_recipients"] = (
-            MailingClient.objects.values("email").distinct().count()
+        # Счетчики поддерживаются при изменениях данных - один запрос вместо трех COUNT
+        context.update(
+            SiteCounter.get_values(
+                SiteCounter.TOTAL_NEWSLETTERS,
+                SiteCounter.ACTIVE_NEWSLETTERS,
+                SiteCounter.UNIQUE_RECIPIENTS,
+            )
         )
         return context
 
@@ -373,28 +443,50 @@ class ContactsView(TemplateView):
     template_name = "mailing_management/contacts.html"
 
 
+class StatisticsView(LoginRequiredMixin, TemplateView):
+    template_name = "mailing_management/statistics.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Статистика по всем рассылкам владельца, из кеша или двумя запросами
+        context["stats"] = get_owner_statistics(self.request.user)
+        return context
+
+
 class SendMailAndUpdateStatisticsView(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
-        # Логика отправки письма
-        user = request.user
+        # Логика отправки тестового письма
         subject = 'Тема письма'
         message = 'Текст сообщения'
-        recipient_list = ['recipient@example.com']
+        recipient_list = [request.user.email]
 
         try:
-            send_mail(subject, message, 'from@example.com', recipient_list)
+            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list)
             success = True
         except Exception as e:
             success = False
 
-        # Обновляем статистику
-        stats, created = NewsletterStatistics.objects.get_or_create(user=user)
-        stats.update_statistics(success)
-
-        # Возвращаем ответ с результатом
+        # Тестовое письмо не относится ни к одной рассылке, поэтому статистику не меняет
         return render(request, 'mailing_management/mail_sent.html', {'success': success})
 
 
+class ExportView(LoginRequiredMixin, View):
+    # Потоковая CSV-выгрузка; ?gzip=1 - со сжатием
+    def get(self, request, name, *args, **kwargs):
+        if name not in EXPORTS:
+            raise Http404("Неизвестная выгрузка")
+        chunks = csv_chunks(name, request.user)
+        filename = f"{name}.csv"
+        content_type = "text/csv; charset=utf-8"
+        if request.GET.get("gzip") == "1":
+            chunks = gzip_chunks(chunks)
+            filename += ".gz"
+            content_type = "application/gzip"
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
 class BlockUserView(LoginRequiredMixin, UserPassesTestMixin, View):
     permission_required = 'can_block_user'
 
@@ -11,4 +11,7 @@ class CustomUserAdmin(admin.ModelAdmin):
         "phone_number",
         "avatar",
     )
-    list_filter = ("email",)
+    # Поиск по точному адресу идет по уникальному индексу; фильтр по email
+    # выводил бы по пункту на каждого пользователя
+    search_fields = ("email__exact",)
+    show_full_result_count = False